@@ -17,6 +17,7 @@ import sys
 import unittest
 import ipaddress
 import logging
+from io import StringIO
 
 if '..' not in sys.path:
     sys.path.insert(0,'..')
@@ -60,6 +61,35 @@ class TestBasicParsing(unittest.TestCase):
         self.assertRaises(parser.ParseError,parse,'FOO!')
         return
     
+    def test_lines(self):
+        """Specs span lines, but a setting's value is the rest of its line."""
+        loader = parser.MultilineStringLoader('ACCOUNT foo\n# comment\n\nMATCHES %account%-%code%\n  WITH ANY();\nPORT: 42\nHOST\n')
+        self.assertRaises(parser.ParseError, loader.load)
+        self.assertEqual(loader.line_number, 8)
+        configuration = parse('ACCOUNT foo MATCHES %account%-%code%\nWITH ANY(); DEBUG ACCOUNT: bar\nPORT: 42\n')
+        self.assertEqual(configuration['debug_account'], 'bar')
+        self.assertEqual(configuration['port'], 42)
+        return
+
+    def test_read_line_override(self):
+        """Subclasses can read the stream themselves by overriding read_line()."""
+        class SemicolonCommentLoader(parser.StreamParsingLoader):
+            def read_line(self):
+                while True:
+                    self.line_number += 1
+                    line = self.fh.readline()
+                    if not line:
+                        raise EOFError()
+                    line = line.split(';;')[0].strip()
+                    if line:
+                        return line
+        text = 'PORT: 42 ;; the port\n;; no hash comments\nACCOUNT foo MATCHES %account%-%code% WITH ANY();\n'
+        configuration = config.from_text(SemicolonCommentLoader(StringIO(text)), raise_on_error=True)
+        self.assertEqual(configuration.port, 42)
+        self.assertEqual(len(configuration.config['aliases']), 1)
+        self.assertEqual(configuration.config['aliases'][0].accounts, ['foo'])
+        return
+
     def test_commented_line(self):
         """A commented line."""
         configuration = parse('# HOST: 1.2.3.4\nPORT: 42\n')
@@ -86,6 +116,97 @@ class TestBasicParsing(unittest.TestCase):
         self.assertEqual(configuration['port'], 42)
         
         return
+    
+    def test_default_config(self):
+        """Every default config gets its own list of aliases."""
+        first = config.Configuration()
+        second = config.Configuration()
+        
+        self.assertIsNot(first.config, second.config)
+        self.assertIsNot(first.config['aliases'], second.config['aliases'])
+        self.assertIs(first.host, second.host)
+        self.assertEqual(first.host, HOST)
+        first.config['aliases'].append(None)
+        self.assertEqual(second.config['aliases'], [])
+        self.assertEqual(parser.MultilineStringLoader('').config, { 'aliases': [] })
+        
+        return
+    
+    def test_from_string(self):
+        """Loading the same string twice only parses it once, but shares no specs."""
+        text = 'PORT: 42\nACCOUNT foo MATCHES %account%-%ident%-%code% WITH CHARS(1);\n'
+        first = config.from_string(text, raise_on_error=True)
+        second = config.from_string(text, raise_on_error=True)
+        
+        self.assertIsNot(first, second)
+        self.assertIs(config.parsed_string(text), config.parsed_string(text))
+        self.assertEqual(second.port, 42)
+        first.config['port'] = 43
+        self.assertEqual(second.config['port'], 42)
+        
+        first_spec = first.config['aliases'][0]
+        second_spec = second.config['aliases'][0]
+        self.assertIsNot(first_spec, second_spec)
+        self.assertIsNot(first_spec.matchex, second_spec.matchex)
+        self.assertIsNot(first_spec.calc, second_spec.calc)
+        self.assertEqual(second_spec.calc.calcs, (['CHARS', 1],))
+        first_spec.accounts.append('bar')
+        self.assertEqual(second_spec.accounts, ['foo'])
+        self.assertEqual(config.from_string(text, raise_on_error=True).config['aliases'][0].accounts, ['foo'])
+        
+        return
+    
+    def test_update_settings(self):
+        """Updating just the settings leaves the maps alone."""
+        configuration = config.from_string('ACCOUNT foo MATCHES %account%-%code% WITH DIGITS();', raise_on_error=True)
+        accounts = configuration.accounts
+        configuration.update_config(dict(port=4243))
+        self.assertEqual(configuration.port, 4243)
+        self.assertIs(configuration.accounts, accounts)
+        configuration.update_config(dict(aliases=[]))
+        self.assertEqual(configuration.accounts, {})
+        return
+
+    def test_refresh_settings(self):
+        """Direct changes to the config dictionary take effect with refresh_settings()."""
+        configuration = config.from_string('PORT: 42\nDEBUG ACCOUNT: foo\n', raise_on_error=True)
+        configuration.found['bar'] = ('baz', None)
+        configuration.config['port'] = 43
+        self.assertEqual(configuration.port, 42)
+        self.assertEqual(configuration.refresh_settings().port, 43)
+        self.assertEqual(configuration.found, {})
+        
+        copied = configuration.copy()
+        copied.config['port'] = 44
+        self.assertEqual(copied.refresh_settings().port, 44)
+        self.assertEqual(configuration.port, 43)
+        
+        # Missing settings take their defaults.
+        del configuration.config['debug_account']
+        self.assertEqual(configuration.refresh_settings().debug_account, DEBUG_ACCOUNT)
+        configuration.config = { 'aliases': [] }
+        self.assertEqual(configuration.refresh_settings().port, PORT)
+        self.assertEqual(configuration.host, HOST)
+        return
+    
+    def test_try_load(self):
+        """try_load() returns the error instead of raising it."""
+        error = config.Configuration().try_load(parser.MultilineStringLoader('PORT: 65536\n'))
+        self.assertIsInstance(error, ValueError)
+        self.assertIsNone(config.Configuration().try_load(parser.MultilineStringLoader('PORT: 42\n')))
+        return
+    
+    def test_from_text_stream(self):
+        """Streams are read and share the parse (but not the specs) of identical text."""
+        text = 'PORT: 4242\nACCOUNT foo MATCHES %account%-%code% WITH ANY();\n'
+        configuration = config.from_text(StringIO(text), raise_on_error=True)
+        self.assertEqual(configuration.port, 4242)
+        hits = config.parsed_string.cache_info().hits
+        reloaded = config.from_text(StringIO(text), raise_on_error=True)
+        self.assertEqual(config.parsed_string.cache_info().hits, hits + 1)
+        self.assertEqual(reloaded.port, 4242)
+        self.assertIsNot(reloaded.config['aliases'][0], configuration.config['aliases'][0])
+        return
 
 class TestParsingConfig(unittest.TestCase):
     """Tests parsing configuration values."""
@@ -139,6 +260,10 @@ class TestParsingConfig(unittest.TestCase):
                               msg='Should have parsed joe123'
                              )
         self.assertRaises(ValueError, parse, 'DEBUG ACCOUNT: joe@example.com \n\n')
+        # The value is the rest of the line as written, not its tokens rejoined.
+        self.assertEqual(parse('DEBUG ACCOUNT: joe\t123 \n')['debug_account'], 'joe\t123')
+        self.assertEqual(parse('DEBUG ACCOUNT : joe\t\t123\n')['debug_account'], 'joe\t\t123')
+        self.assertEqual(parse('DEBUG\nACCOUNT :  joe\t123\n')['debug_account'], 'joe\t123')
         return
     
 class TestParsingAliases(unittest.TestCase):
@@ -153,6 +278,16 @@ class TestParsingAliases(unittest.TestCase):
         self.assertRaises(parser.ParseError, parse, '   \nACCOUNT ALIASED foo WITH ANY(); \n \n\n')        
         return
 
+    def test_using(self):
+        """USING sets the matcher for the account and alias."""
+        aliases = parse('ACCOUNT foo USING alpha MATCHES %account%-%ident%-%code% WITH CHARS(1);')['aliases']
+        self.assertEqual(aliases[0].matchex.account_matcher, 'alpha')
+        self.assertEqual(aliases[0].matchex.sketch[1].char_sets,
+                         aliases[0].matchex.IDENT_MATCHERS['alpha'].char_sets)
+        self.assertRaises(config.SemanticError, parse,
+                          'ACCOUNT foo USING walrus MATCHES %account%-%ident%-%code% WITH CHARS(1);')
+        return
+
     def test_basic_alias(self):
         """A basic sanity check."""
         aliases = parse('ACCOUNT foo MATCHES %ident%-%code% WITH CHARS();')['aliases']
@@ -193,6 +328,18 @@ class TestParsingAliases(unittest.TestCase):
                         )
         return
     
+    def test_account_commas(self):
+        """Commas can be attached to either account, or stand alone."""
+        aliases = parse("""
+                        ACCOUNT foo ,bar , baz,
+                                zeep
+                        MATCHES %account%-%ident%-%code%
+                        WITH  CHAR(1,-);
+                        """
+                       )['aliases']
+        self.assertEqual(aliases[0].accounts, ['foo', 'bar', 'baz', 'zeep'])
+        return
+    
     def test_multiple_aliases(self):
         """Multiple aliases for an account."""
         aliases = parse("""
@@ -283,6 +430,28 @@ class TestMatchexSemantics(unittest.TestCase):
                          msg="Successfully parsed matchex should have 7 elements."
                         )
         return
+    
+    def test_leading_adjacent(self):
+        """Adjacent matchers at the start don't leave "%" literals behind."""
+        aliases = parse("""
+                        ACCOUNT foo
+                        MATCHES %alpha%%number%-%code%
+                        WITH ANY(1),ANY(2);
+                        """
+                       )['aliases']
+        self.assertEqual(aliases[0].matchex.tokens, ['', 'alpha', '', 'number', '-', 'code', ''])
+        return
+    
+    def test_escaped_percent(self):
+        """"%%" outside of a matchvalue is a literal "%"."""
+        aliases = parse("""
+                        ACCOUNT foo
+                        MATCHES 100%%%alpha%-%code%
+                        WITH ANY(1);
+                        """
+                       )['aliases']
+        self.assertEqual(aliases[0].matchex.tokens, ['100%', 'alpha', '-', 'code', ''])
+        return
 
 class TestCalcSemantics(unittest.TestCase):
     """Verifies semantic checking of calcs."""
@@ -544,6 +713,21 @@ class TestUniqueness(unittest.TestCase):
                        )
         return
     
+    def test_account_literal_bad(self):
+        """A literal which spells out a matchvalue isn't that matchvalue."""
+        self.assertRaises(config.SemanticError, parse,
+                          """
+                          ACCOUNT foo
+                          MATCHES %alpha%account%code%
+                          WITH ANY();
+                          
+                          ACCOUNT bar
+                          MATCHES %alpha%account%code%
+                          WITH ANY();
+                        """
+                       )
+        return
+    
     def test_account_unique_alias_good(self):
         """Test successful validation of an account and alias both unique."""
         aliases = parse("""
@@ -648,6 +832,23 @@ class TestUniqueness(unittest.TestCase):
                         """
                        )
         return
+    
+    def test_account_many_aliases_any_bad(self):
+        """Every alias with one account counts, not just whichever comes first."""
+        self.assertRaises(config.SemanticError, parse,
+                          """
+                          ACCOUNT foo
+                          ALIASED fizz
+                          MATCHES %account%-%alpha%-%code%
+                          WITH ANY();
+                          
+                          ACCOUNT foo, bar
+                          ALIASED buzz
+                          MATCHES %account%-%alias%-%alpha%-%code%
+                          WITH ANY();
+                        """
+                       )
+        return
 
     def test_many_accounts_good(self):
         """Test successful validation of many accounts single alias."""
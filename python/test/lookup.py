@@ -19,7 +19,7 @@ import unittest
 if '..' not in sys.path:
     sys.path.insert(0,'..')
 
-from trualias.lookup import LookupThing
+from trualias.lookup import LookupThing, prescreen
 import trualias.config as config
 import trualias.parser as parser
 
@@ -95,6 +95,89 @@ class TestAliasNameLookup(unittest.TestCase):
     def test_xxx_ambiguous_good(self):
         self.assertEqual(self.looker.find('xxxxxx.00'),'baz')
         return
+    
+    def test_prescreen(self):
+        """Only specifications whose literals are all present are candidates."""
+        self.assertEqual(len(prescreen('hello', self.config)), 0)
+        self.assertEqual([ spec.matchex.expression for spec in prescreen('magic8balla5', self.config) ],
+                         ['%alpha%8ball%code%'])
+        self.assertEqual(len(prescreen('isisxisis.20', self.config)), 2)
+        # %account% requires one of the spec's accounts.
+        self.assertEqual([ spec.matchex.expression for spec in prescreen('zzz-ab12-0', self.config) ],
+                         ['%alias%-%ident%-%code%'])
+        self.assertEqual(len(prescreen('bar-ab12-0', self.config)), 2)
+        return
+    
+    def test_prescreen_prefix(self):
+        """Specifications have to start with the literal their expression starts with."""
+        config = parse("""
+            ACCOUNT foo
+            MATCHES x-%ident%-%code%
+            WITH CHARS(1);
+            ACCOUNT foo
+            MATCHES xy-%ident%-%code%
+            WITH DIGITS(1);
+            ACCOUNT foo
+            MATCHES %ident%-y-%code%
+            WITH VOWELS(1);
+        """)
+        self.assertEqual([ spec.matchex.expression for spec in prescreen('x-abc-y-3', config) ],
+                         ['x-%ident%-%code%', '%ident%-y-%code%'])
+        self.assertEqual([ spec.matchex.expression for spec in prescreen('xy-abc-y-0', config) ],
+                         ['xy-%ident%-%code%', '%ident%-y-%code%'])
+        self.assertEqual(len(prescreen('y-x-abc-3', config)), 0)
+        return
+    
+    def test_scan_address(self):
+        """Finds all of the (possibly overlapping) accounts in an address."""
+        self.assertEqual(self.config.scan_address('xfoobarbazx'),
+                         [ (1, 3, 'foo'), (4, 6, 'bar'), (7, 9, 'baz') ])
+        self.assertEqual(self.config.scan_address('griselda'), [])
+        return
+
+    def test_ambiguous_debug(self):
+        """Matches delivering to different accounts go to the debug account."""
+        config = parse("""
+            DEBUG ACCOUNT: debug_account
+            ACCOUNT foo
+            MATCHES %alpha%-%code%
+            WITH ANY();
+            ACCOUNT bar
+            MATCHES %alnum%-%code%
+            WITH ANY();
+            ACCOUNT baz
+            MATCHES %ident%-%code%
+            WITH CHARS(1);
+        """)
+        looker = LookupThing(config)
+        self.assertEqual(looker.find('ab-a'), 'debug_account')
+        self.assertEqual(looker.find('ab1-1'), 'bar')
+        self.assertEqual(looker.find('ab_1-4'), 'baz')
+        return
+    
+    def test_found(self):
+        """Results are memoized until the configuration changes."""
+        self.assertEqual(self.looker.find('bar-none-0n2'),'bar')
+        self.assertEqual(self.config.found['bar-none-0n2'], ('bar', None))
+        self.assertEqual(self.looker.find('bar-none-0n2'),'bar')
+        self.assertEqual(len(self.config.found), 1)
+        self.config.update_config(dict(debug_account='someone'))
+        self.assertEqual(len(self.config.found), 0)
+        return
+    
+    def test_found_lru(self):
+        """When the memoized results are full, the least recently used one goes."""
+        found_cache_size = config.Configuration.FOUND_CACHE_SIZE
+        config.Configuration.FOUND_CACHE_SIZE = 2
+        try:
+            self.looker.find('bar-none-0n2')
+            self.looker.find('foo-bar')
+            self.looker.find('bar-none-0n2')
+            self.looker.find('baz')
+        finally:
+            config.Configuration.FOUND_CACHE_SIZE = found_cache_size
+        self.assertEqual(list(self.config.found), ['bar-none-0n2', 'baz'])
+        return
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
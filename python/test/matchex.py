@@ -25,7 +25,7 @@ import trualias.parser as parser
 import trualias.matching as matching
 
 def parse(text):
-    return config.from_text(parser.MultilineStringLoader(text),raise_on_error=True).config['aliases']
+    return config.from_string(text,raise_on_error=True).config['aliases']
 
 class TestSimpleSketchCases(unittest.TestCase):
     """Does it work? Is there smoke?"""
@@ -71,6 +71,62 @@ class TestSimpleSketchCases(unittest.TestCase):
         matched = matchex.match_sketch(matchex.sketch, 'foo-bar---3')
         self.assertEqual(len(matched), 0)
         return
+    
+    def test_feasible(self):
+        """Addresses which are too short or missing literal characters are ruled out."""
+        matchex = self.aliases[0].matchex
+        
+        self.assertEqual(matchex.min_length, 5)
+        self.assertTrue(matchex.feasible('f-b-3'))
+        self.assertFalse(matchex.feasible('f-b3'))
+        self.assertFalse(matchex.feasible('foo+bar+3'))
+        # The characters are counted with the AddressIndex, which keeps them.
+        index = matching.AddressIndex('f-b-3')
+        self.assertTrue(matchex.feasible('f-b-3', index))
+        self.assertEqual(index.offsets('-'), [1, 3])
+        return
+    
+    def test_prescan_literal(self):
+        """Without matchers, only the literal itself gets past the prescan."""
+        matchex = parse('ACCOUNT foo MATCHES foo WITH ANY();')[0].matchex
+        
+        self.assertTrue(matchex.prescan('foo'))
+        self.assertFalse(matchex.prescan('foofoo'))
+        self.assertFalse(matchex.prescan('fo'))
+        return
+    
+    def test_prescan(self):
+        """The literals have to occur in order with room for the matchers."""
+        matchex = self.aliases[0].matchex
+        
+        self.assertTrue(matchex.prescan('foo-bar-3'))
+        self.assertTrue(matchex.prescan('foo-bar---3'))
+        self.assertFalse(matchex.prescan('foo--3'))
+        self.assertFalse(matchex.prescan('-foo-3'))
+        self.assertFalse(matchex.prescan('foo-bar3'))
+        return
+    
+    def test_prescan_compiled_lazily(self):
+        """The scanner isn't compiled until it's needed."""
+        matchex = config.from_text(parser.MultilineStringLoader(self.TEST_CONFIGURATION),
+                                   raise_on_error=True).config['aliases'][0].matchex
+        self.assertEqual(matchex.scanner, matchex.first_prescan)
+        self.assertTrue(matchex.prescan('foo-bar-3'))
+        self.assertNotEqual(matchex.scanner, matchex.first_prescan)
+        self.assertFalse(matchex.prescan('foo-bar3'))
+        return
+    
+    def test_materialize(self):
+        """The account is substituted into the literal, which is then reused."""
+        matchex = self.aliases[0].matchex
+        
+        sketch = matchex.account_sketch.materialize('foo', '')
+        self.assertEqual(len(sketch), 5)
+        self.assertEqual(sketch[0], 'foo-')
+        self.assertIs(matchex.account_sketch.materialize('foo', ''), sketch)
+        matched = matchex.match_sketch(sketch, 'foo-bar-3')
+        self.assertEqual([ ident.value for ident in matched[0]], ['bar', '3'])
+        return
 
 class TestMatchingPrimitives(unittest.TestCase):
     """Tests for matching primitives."""
@@ -99,6 +155,10 @@ class TestMatchingPrimitives(unittest.TestCase):
         self.assertEqual(result, (8,8))
         result = matcher("aaa.bbb.c-c", start_pos=8, end_pos=9, minimal=True)
         self.assertEqual(result, (8,10))
+        result = matcher("ab_-x", start_pos=0, end_pos=3, minimal=True)
+        self.assertEqual(result, (0,1))
+        result = matcher("aaa.bbb.c-c", start_pos=8, end_pos=20, minimal=True)
+        self.assertEqual(result, (8,10))
 
         result = matcher.match_one_more("aaa.bbb.c-c", start_pos=7, end_pos=6)
         self.assertFalse(result)
@@ -108,6 +168,30 @@ class TestMatchingPrimitives(unittest.TestCase):
         self.assertFalse(result)
         
         return
+    
+    def test_check_range(self):
+        """Constant time exact matching agrees with the matcher."""
+        matcher = matching.Matcher(self.MATCH_AT_ENDS, self.MATCH_INTERIOR, self.MATCH_AT_ENDS)
+        address = "aaa.bbb.c-c_a"
+        index = matching.AddressIndex(address)
+        for start_pos in range(len(address)):
+            for end_pos in range(len(address)):
+                self.assertEqual(matcher.check_range(index, start_pos, end_pos),
+                                 matcher(address, start_pos, end_pos) is not None)
+        return
+        
+    def test_code_check_range(self):
+        """Exact matching against codes agrees with the code matcher."""
+        matcher = matching.MatchCode()
+        for match_type in ('number', 'any', 'any', 'number', 'number'):
+            matcher.append(match_type)
+        for address in ('1ab23', 'x1ab234y', '1-b.22a3', '12345678'):
+            index = matching.AddressIndex(address)
+            for start_pos in range(len(address)):
+                for end_pos in range(len(address)):
+                    self.assertEqual(matcher.check_range(index, start_pos, end_pos),
+                                     matcher(address, start_pos, end_pos) is not None)
+        return
         
     def test_any_matcher(self):
         """Matches anything."""
@@ -142,6 +226,10 @@ class TestMatchingPrimitives(unittest.TestCase):
         self.assertEqual(result, None)
         result = matcher("aaa.b2b.c-c", start_pos=5, end_pos=None, minimal=False)
         self.assertEqual(result, (5,5))
+        result = matcher("a12x34b", start_pos=1, end_pos=None, minimal=False)
+        self.assertEqual(result, (1,5))
+        result = matcher("aaa.b2b.c-2", start_pos=10, end_pos=None, minimal=False)
+        self.assertEqual(result, (10,10))
         
         return
 
@@ -287,6 +375,46 @@ class TestMoreSketchCases(unittest.TestCase):
 
         return
 
+    def test_adjacent_matchers(self):
+        """
+        ACCOUNT foo
+        MATCHES %account%-%alpha%%number%-%code%
+        WITH ANY(account);
+        """
+        alias = parse(self.test_adjacent_matchers.__doc__)[0]
+        matchex = alias.matchex
+
+        matched = matchex.match_sketch(matchex.sketch, 'foo-ab12-f')
+        self.assertEqual([ ident.value for ident in matched[0]], ['foo', 'ab', '12', 'f'])
+        # Characters outside of ASCII don't start (or match) anything.
+        self.assertFalse(matchex.match_sketch(matchex.sketch, 'foo-ab٣12-f'))
+        self.assertFalse(matchex.match_sketch(matchex.sketch, 'foo-ab12é-f'))
+        return
+
+    def test_account_matcher(self):
+        """The account matcher is per expression."""
+        specs = []
+        for account_matcher in ('alpha', 'ident'):
+            spec = alias.Alias()
+            spec.accounts = ['foo', 'foo1']
+            spec.matchex.account_matcher = account_matcher
+            spec.matchex.expression = ('%account%-%ident%-%code%', 1)
+            spec.calc.calcs = ([['CHARS', 1]], 1)
+            specs.append(spec)
+        # Sketches are built after all of the specs have been parsed.
+        for spec in specs:
+            spec.semantic_check()
+        self.assertEqual(specs[0].matchex.sketch[1].char_sets,
+                         alias.MatchExpression.IDENT_MATCHERS['alpha'].char_sets)
+        self.assertEqual(specs[1].matchex.sketch[1].char_sets,
+                         alias.MatchExpression.IDENT_MATCHERS['ident'].char_sets)
+        self.assertEqual(specs[0].matchex.account_matcher, 'alpha')
+        self.assertEqual(alias.MatchExpression().account_matcher, 'ident')
+        self.assertTrue(specs[0].match('foo-bar-3'))
+        self.assertFalse(specs[0].match('foo1-bar-3'))
+        self.assertTrue(specs[1].match('foo1-bar-3'))
+        return
+    
 class TestCalcFunctions(unittest.TestCase):
     """Test the defined calc functions."""
     
@@ -26,9 +26,12 @@ set to a print function which accepts a string, for example:
 """
 
 import logging
+import re
+from collections import Counter, namedtuple
+from types import MappingProxyType
 
 from .config_base import ConfigurationError
-from .utils import TestableIterator, BasicBooleanResult
+from .utils import TestableIterator
 from .matching import *
 
 # Final result for the sketch.
@@ -41,6 +44,12 @@ PRINT_CALC_CODE = None
 PRINT_CALC_VALUE = None
 # Details of match recursion.
 PRINT_MATCH_SKETCH = None
+# Source of the generated prescan() functions.
+PRINT_PRESCAN_SOURCE = None
+
+# A match expression is literal text and %matchvalue%s. An unterminated matchvalue
+# at the end is tolerated; "%%" (an empty matchvalue) is a literal "%".
+MATCH_EXPRESSION_TOKENS = re.compile(r'%([^%]*)(?:%|$)|([^%]+)')
 
 class SemanticError(ConfigurationError):
     """A semantic error occurred."""
@@ -111,26 +120,27 @@ class Literal(object):
     address, but is subject to substitution.
     """
     def __init__(self, parts, subs, params):
-        """Define a literal with the specified parts and substitutions."""
-        parts = TestableIterator(parts)
-        # Put empty slots between the parts of parts for later substitutions.
-        self.parts = [ parts.next() ]
-        while parts():
-            self.parts += [ '', parts.next() ]
-        self.subs = subs
+        """Define a literal with the specified parts and substitutions.
+        
+        The parts are compiled into a template for str.format_map() with the
+        substitutions (params keys) between them.
+        """
+        template = [ parts[0].replace('{', '{{').replace('}', '}}') ]
+        for sub, part in zip(subs, parts[1:]):
+            template += [ '{' + sub + '}', part.replace('{', '{{').replace('}', '}}') ]
+        self.template = ''.join(template)
         self.params = params
+        # The string for the current params; Sketch.using() resets it.
+        self.value = None
         return
     
     def __repr__(self):
-        return '<Literal "{}">'.format(''.join((str(part) for part in self.parts)))
+        return '<Literal "{}">'.format(self.template)
     
     def __str__(self):
-        i = 0
-        parts = self.parts      # Actually modified in place.
-        for sub in self.subs:
-            parts[i*2 + 1] = self.params[sub]
-            i += 1
-        return ''.join((str(part) for part in parts))
+        if self.value is None:
+            self.value = self.template.format_map(self.params)
+        return self.value
 
 class Sketch(object):
     """A matching sketch.
@@ -141,37 +151,52 @@ class Sketch(object):
     
     NOT THREAD SAFE. using() uses instance storage for the actual account and alias
     represented in the returned sketch.
+    
+    materialize() returns the sketch with the account and alias substituted as plain
+    strings. These are cached, there being a fixed number of accounts and aliases.
     """
     def __init__(self, sketch):
         """Compile the passed sketch into one which can be efficiently substituted into."""
         self.params = dict(account=None, alias=None)
-        self.sketch = []
-        sketch = TestableIterator(sketch)
-        while sketch():
-            parts = [ sketch.next() ]   # literal
+        compiled = []
+        i = 0
+        while i < len(sketch):
+            parts = [ sketch[i] ]       # literal
             subs = []
-            while sketch():
-                if sketch.next(lookahead=True).name not in self.params:
-                    break
-                subs.append( sketch.next().name )
-                parts.append( sketch.next() )
-            self.sketch.append( Literal(parts, subs, self.params) )
-            if sketch():
-                self.sketch.append( sketch.next() )
-                
+            i += 1
+            # Substituted Matchers are followed by the next part of the literal.
+            while i < len(sketch) and sketch[i].name in self.params:
+                subs.append( sketch[i].name )
+                parts.append( sketch[i+1] )
+                i += 2
+            compiled.append( Literal(parts, subs, self.params) )
+            if i < len(sketch):
+                compiled.append( sketch[i] )
+                i += 1
+        self.sketch = tuple(compiled)
+        self.materialized = {}
         return
     
     def using(self, account, alias):
         self.params['account'] = account
         self.params['alias'] = alias
+        for literal in self.sketch[::2]:
+            literal.value = None
         return self.sketch
+    
+    def materialize(self, account, alias):
+        """Returns the sketch for account and alias with the literals as strings."""
+        sketch = self.materialized.get((account, alias))
+        if sketch is None:
+            sketch = self.materialized[(account, alias)] = tuple(
+                        str(element) if isinstance(element, Literal) else element
+                        for element in self.using(account, alias)
+                    )
+        return sketch
 
-class Identifier(object):
+class Identifier(namedtuple('Identifier', 'type value')):
     """One matched identifier."""
-    def __init__(self,type,value):
-        self.type = type
-        self.value = value
-        return
+    __slots__ = ()
     
     def __repr__(self):
         return '"{}"({})'.format(self.value, self.type)
@@ -180,35 +205,42 @@ class IdentifierList(list):
     """Lists of matched identifiers.
     
     This is the list of lists identifier matches in a matched expression.
-    Each item in the list is a list of the identifiers matched for that particular
+    Each item in the list is a tuple of the identifiers matched for that particular
     match.
     """
+    __slots__ = ('success', 'code')
+    
     def __init__(self, success=True):
         """Create an IdentifierList.
         
         IdentifierLists have boolean semantics indicating whether or not there
         was any sublist match at all. As a consequence, when there was a successful
         match and everything has been consumed, we need an "empty" state which is
-        also "success".
+        also "success"; that's what the success flag is for.
         """
-        if success:
-            # This is cleaned up in append() and provides semantic sugar a.k.a. "success".
-            list.append(self, [])
+        list.__init__(self)
+        self.success = success
         self.code = None
         return
     
+    def __bool__(self):
+        return self.success
+    
     def append(self, type, value, sublists):
         """Appends annotated sublists to the list.
         
         The identifier lists are built in reverse order. When a sub
         match is found and percolates up, the match at this level needs
-        to be prepended to each of the sublists.
+        to be prepended to each of the sublists. An empty (but successful)
+        list of sublists is the end of the match.
         """
-        for match in sublists:
-            if match:
-                list.append(self, [Identifier(type.name, value)] + match )
-            else:
-                list.append(self, [Identifier(type.name, value)] )
+        ident = (Identifier(type.name, value),)
+        if len(sublists):
+            for match in sublists:
+                list.append(self, ident + match)
+        else:
+            list.append(self, ident)
+        self.success = True
         return
     
     def unpack(self):
@@ -216,16 +248,24 @@ class IdentifierList(list):
         
         Returns (code, idents) where idents is an (indexed) list of the Identifiers
         to calculate from.
+        
+        Every match comes from the same sketch, so the identifiers are of the same
+        types in the same positions in all of them; the positions are worked out
+        from the first one.
         """
+        if not len(self):
+            return
+        code_pos = None
+        ident_pos = []
+        for pos, ident in enumerate(self[0]):
+            if ident.type == 'code':
+                code_pos = pos
+            elif ident.type in MatchExpression.IDENT_MATCHERS:
+                ident_pos.append(pos)
         for match in self:
-            code = None
-            idents = []
-            for ident in match:
-                if ident.type == 'code':
-                    code = ident
-                elif ident.type in MatchExpression.IDENT_MATCHERS:
-                    idents.append(ident)
-            yield code, idents
+            yield ( code_pos is not None and match[code_pos] or None,
+                    [ match[pos] for pos in ident_pos ]
+                  )
     
 class MatchFailed(Exception):
     """A convenient way to abort processing when matching is no longer possible.
@@ -238,6 +278,11 @@ class MatchFailed(Exception):
 
 class MatchExpression(object):
     """A match expression."""
+    __slots__ = ( 'account_matcher_', 'all_matchers', 'expression_', 'line_number', 'identifiers',
+                  'fqdns', 'tokens', 'literals', 'matchvalues', 'unique',
+                  'sketch', 'min_length', 'required_chars',
+                  'scanner', 'account_sketch'
+                )
     DEFAULT_ACCOUNT_MATCH = 'ident'
     IDENT_MATCHERS = dict(   alnum=Matcher('alnum',MATCH_ALNUM),
                              alpha=Matcher('alpha',MATCH_ALPHA),
@@ -245,17 +290,32 @@ class MatchExpression(object):
                              ident=Matcher('ident',MATCH_ALNUM,MATCH_IDENT,MATCH_ALNUM),
                              fqdn=MatchFQDN('fqdn',MATCH_ALNUM,MATCH_FQDN,MATCH_ALNUM)
                            )
-    ALL_MATCHERS = dict( IDENT_MATCHERS,
-                             account=Matcher('account',MATCH_IDENT),
-                             alias=Matcher('alias',MATCH_IDENT),
+    # Shared by every expression using the default account matcher. Expressions
+    # USING some other matcher get their own; see account_matcher.
+    DEFAULT_MATCHERS = MappingProxyType(dict( IDENT_MATCHERS,
+                             account=IDENT_MATCHERS[DEFAULT_ACCOUNT_MATCH].copy('account'),
+                             alias=IDENT_MATCHERS[DEFAULT_ACCOUNT_MATCH].copy('alias'),
                              code=MatchAny('code')
-                       )
-    FRIENDLIES = { 'alpha', 'number' }
+                       ))
+    FRIENDLIES = frozenset(( 'alpha', 'number' ))
+    # (friendly, identifier, fqdn) for each matchvalue, so that compiling an
+    # expression looks each one up once.
+    MATCHVALUE_KINDS = dict(
+                            alnum=(False, True, False),
+                            alpha=(True, True, False),
+                            number=(True, True, False),
+                            ident=(False, True, False),
+                            fqdn=(False, True, True),
+                            account=(False, False, False),
+                            alias=(False, False, False),
+                            code=(False, False, False)
+                           )
     
-    MATCH_ANY_CHAR = { 'ANY', 'NONE', 'CHAR' }
+    MATCH_ANY_CHAR = frozenset(( 'ANY', 'NONE', 'CHAR' ))
     
     def __init__(self):
-        self.account_matcher = self.DEFAULT_ACCOUNT_MATCH
+        self.account_matcher_ = self.IDENT_MATCHERS[self.DEFAULT_ACCOUNT_MATCH]
+        self.all_matchers = self.DEFAULT_MATCHERS
         return
     
     def __str__(self):
@@ -263,15 +323,26 @@ class MatchExpression(object):
     
     @property
     def account_matcher(self):
-        return self.account_matcher_
+        """The name of the matcher for %account% and %alias%.
+        
+        The Matcher itself is resolved when this is set.
+        """
+        return self.account_matcher_.name
     
     @account_matcher.setter
     def account_matcher(self, value):
+        if isinstance(value,tuple):
+            value, self.line_number = value
         if value not in self.IDENT_MATCHERS:
-            self.parse_error('Unrecognized identifier matcher: "{}"'.format(value))
-        self.account_matcher_ = value
-        self.ALL_MATCHERS['account'] = self.IDENT_MATCHERS[self.account_matcher_].copy('account')
-        self.ALL_MATCHERS['alias'] = self.IDENT_MATCHERS[self.account_matcher_].copy('alias')
+            self.semantic_error('Unrecognized identifier matcher: "{}"'.format(value))
+        matcher = self.account_matcher_ = self.IDENT_MATCHERS[value]
+        if value == self.DEFAULT_ACCOUNT_MATCH:
+            self.all_matchers = self.DEFAULT_MATCHERS
+        else:
+            self.all_matchers = dict( self.DEFAULT_MATCHERS,
+                                      account=matcher.copy('account'),
+                                      alias=matcher.copy('alias')
+                                    )
         return
     
     @property
@@ -284,55 +355,61 @@ class MatchExpression(object):
         
         Semantic validity chiefly means that only alpha and number can occur
         adjacent to each other.
+        
+        The resulting tokens alternate between literals and matchvalues, starting
+        and ending with a (possibly empty) literal.
         """
         if isinstance(value,tuple):
             value, self.line_number = value
         self.identifiers = 0
-        self.fqdns = set()
-        input_tokens = value.split('%')
+        fqdns = []
         tokens = []
+        literal = []
         state = ''
-        outside = False
-        i = 0
-        for tok in input_tokens:
-            i += 1
-            outside ^= True
-            if outside:
-                if not tok and i+1 < len(input_tokens) and not input_tokens[i+1]:
-                    tokens.append('%')
-                else:
-                    tokens.append(tok)
-                if tok:
-                    state = ''
+        for token in MATCH_EXPRESSION_TOKENS.finditer(value):
+            tok = token.group(1)
+            if tok is None:
+                literal.append(token.group(2))
+                state = ''
+                continue
+            if not tok:
+                # "%%" is a literal "%".
+                literal.append('%')
+                state = ''
+                continue
+            
+            kind = self.MATCHVALUE_KINDS.get(tok)
+            if kind is None:
+                self.semantic_error('Unrecognized matchvalue "{}".'.format(tok))
+            friendly, identifier, fqdn = kind
+            if state == 'poison':
+                self.semantic_error('"{}" cannot occur next to any other matcher.'.format(tok))
+            
+            # Here state is either empty or a friendly.
+            if friendly:
+                if tok == state:
+                    self.semantic_error('"{}" cannot occur next to itself.'.format(tok))
+                state = tok
             else:
-                if not tok:
-                    if i > 0 and not input_tokens[i-1]:
-                        continue
-                    else:
-                        self.semantic_error('Empty matchvalue.')
-                else:
-                    if tok not in self.ALL_MATCHERS:
-                        self.semantic_error('Unrecognized matchvalue "{}".'.format(tok))
-                    if state == 'poison':
-                        self.semantic_error('"{}" cannot occur next to any other matcher.'.format(tok))
-                        
-                    if tok in self.FRIENDLIES:
-                        if tok == state:
-                            self.semantic_error('"{}" cannot occur next to itself.'.format(tok))
-                        state = tok
-                    else:
-                        if state in self.FRIENDLIES:
-                            self.semantic_error('"{}" cannot occur next to any other matcher.'.format(tok))
-                        state = 'poison'
-                        
-                    if tok in self.IDENT_MATCHERS:
-                        self.identifiers += 1
-                        if tok == 'fqdn':
-                            self.fqdns.add(self.identifiers)
-                        
-                    tokens.append(tok)
+                if state:
+                    self.semantic_error('"{}" cannot occur next to any other matcher.'.format(tok))
+                state = 'poison'
+                
+            if identifier:
+                self.identifiers += 1
+                if fqdn:
+                    fqdns.append(self.identifiers)
+            
+            tokens.append(''.join(literal))
+            tokens.append(tok)
+            literal = []
+        tokens.append(''.join(literal))
 
+        self.fqdns = frozenset(fqdns)
         self.tokens = tokens
+        self.literals = tuple(tokens[::2])
+        # Literals could spell out a matchvalue, so membership is tested against these.
+        self.matchvalues = frozenset(tokens[1::2])
         self.expression_ = value
         return
     
@@ -343,29 +420,155 @@ class MatchExpression(object):
     
     def build_sketch(self, calcs):
         """Build a sketch to allow us to rule out / in whether or not an address potentially matches."""
-        sketch = []
-        outside = False
-        for tok in self.tokens:
-            outside ^= True
-            if outside:
-                sketch.append(tok)
-                continue
+        sketch = [ self.literals[0] ]
+        for tok, literal in zip(self.tokens[1::2], self.literals[1:]):
             if tok != 'code':
-                matcher = self.ALL_MATCHERS[tok]
-                sketch.append(matcher)
-                continue
-            
-            # tok == 'code'
-            code_matcher = MatchCode('code')
-            for calc in calcs.calcs:
-                code_matcher.append(calc[0] in self.MATCH_ANY_CHAR and 'any' or 'number')
-            sketch.append(code_matcher)
+                sketch.append(self.all_matchers[tok])
+            else:
+                code_matcher = MatchCode('code')
+                for calc in calcs.calcs:
+                    code_matcher.append(calc[0] in self.MATCH_ANY_CHAR and 'any' or 'number')
+                sketch.append(code_matcher)
+            sketch.append(literal)
             
-        self.sketch = sketch
+        # Read only from here on.
+        self.sketch = tuple(sketch)
+        
+        # Lower bounds on what an address needs to have in order to match.
+        literals = self.sketch[::2]
+        self.min_length = ( sum(len(literal) for literal in literals)
+                          + sum(matcher.min_length for matcher in self.sketch[1::2])
+                          )
+        self.required_chars = Counter(''.join(literals))
+        # Compiled by the first prescan(), see first_prescan().
+        self.scanner = self.first_prescan
+        self.account_sketch = Sketch(self.sketch)
         return
+    
+    def compile_scanner(self):
+        """Compiles the sketch into a function which performs prescan().
+        
+        The sketch is fixed, so rather than interpreting it for every address
+        the literals, gaps and masks are written into the source of a function
+        specifically for this sketch. Each literal has to be found at least
+        min_gap characters past the end of the previous one. Empty literals
+        (between adjacent Matchers) just add to the gap. The final literal is
+        handled separately as it has to be a suffix of the address.
+        """
+        if len(self.sketch) == 1:
+            # There are no Matchers, so nothing but the literal itself could match.
+            self.scanner = self.sketch[0].__eq__
+            return
+        prefix = self.sketch[0]
+        suffix = self.sketch[-1]
+        source = [ 'def prescan(address):' ]
+        if prefix:
+            source.append('    if not address.startswith({!r}): return False'.format(prefix))
+        if suffix:
+            source.append('    if not address.endswith({!r}): return False'.format(suffix))
+        source.append('    end = len(address) - {}'.format(len(suffix)))
+        # A mask of -1 (e.g. MatchAny) can't rule anything out.
+        mask_checks = []
+        if self.sketch[1].start_mask != -1:
+            mask_checks.append('        if not ({} >> ord(address[{}])) & 1: return False'.format(
+                               self.sketch[1].start_mask, len(prefix)))
+        if self.sketch[-2].end_mask != -1:
+            mask_checks.append('        if not ({} >> ord(address[end-1])) & 1: return False'.format(
+                               self.sketch[-2].end_mask))
+        if mask_checks:
+            source.append('    if {} < end:'.format(len(prefix)))
+            source += mask_checks
+        cursor = str(len(prefix))
+        min_gap = 0
+        for i in range(1, len(self.sketch) - 2, 2):
+            min_gap += self.sketch[i].min_length
+            literal = self.sketch[i+1]
+            if literal:
+                source.append('    cursor = address.find({!r}, {} + {}, end)'.format(literal, cursor, min_gap))
+                source.append('    if cursor < 0: return False')
+                cursor = 'cursor + {}'.format(len(literal))
+                min_gap = 0
+        min_gap += self.sketch[-2].min_length
+        source.append('    return {} + {} <= end'.format(cursor, min_gap))
+        source = '\n'.join(source)
+        if PRINT_PRESCAN_SOURCE:
+            PRINT_PRESCAN_SOURCE('{}:\n{}'.format(self.expression_, source))
+        namespace = {}
+        exec(compile(source, '<prescan {}>'.format(self.expression_), 'exec'), namespace)
+        self.scanner = namespace['prescan']
+        return
+    
+    def prescan(self, address):
+        """A single left to right sweep to see if the address could possibly match.
+        
+        The literals have to occur in order (each one is found at the first place
+        it can occur, which leaves the most room for the rest) with room for the
+        Matchers in between them. The first and last characters matched by the first
+        and last Matchers are also checked, since those are fixed by the anchoring
+        literals. Returning True doesn't mean it matches, but False means it doesn't.
+        
+        See compile_scanner().
+        """
+        return self.scanner(address)
+    
+    def first_prescan(self, address):
+        """Stands in for the scanner until the first prescan(), which compiles it.
+        
+        Compiling the scanner is most of the cost of loading a specification, and
+        in a large configuration many of them may never be consulted.
+        """
+        self.compile_scanner()
+        return self.prescan(address)
+    
+    def feasible(self, address, index=None):
+        """Rules out addresses which are too short or lack the literals' characters.
+        
+        The characters are counted with index, an AddressIndex for the address
+        (created if not supplied); match_sketch() goes on to use the offsets of
+        single character literals.
+        """
+        if len(address) < self.min_length:
+            return False
+        if index is None:
+            index = AddressIndex(address)
+        for c, n in self.required_chars.items():
+            if len(index.offsets(c)) < n:
+                return False
+        return True
 
-    def match_sketch(self, sketch, address, i=0, start_pos=0):
-        """Called recursively to match the sketch.
+    @staticmethod
+    def follows(sketch, i, index):
+        """Returns (end_lit, followers) for the Matcher at sketch[i+1].
+        
+        end_lit is the literal following the Matcher, if any; the places where
+        it can occur are looked up in the AddressIndex. Otherwise followers[k]
+        is 1 if address[k] can start the next Matcher (see AddressIndex.matches()).
+        Offsets where the address has anything else can't end the match, so they
+        are skipped without calling the Matcher.
+        
+        followers is None if the Matcher is the last thing in the sketch, so the
+        only thing it can match is the rest of the address.
+        """
+        end_lit = (len(sketch) > (i + 2)) and sketch[i+2] or None
+        if end_lit or len(sketch) <= (i + 3):
+            return end_lit, None
+        return end_lit, index.matches(sketch[i+3].start_mask)
+
+    def match_sketch(self, sketch, address, i=0, start_pos=0, index=None):
+        """Match the sketch against the address.
+        
+        This is a depth first search of the ways that the Matchers can divide
+        the address up between the literals. Rather than recursing for each
+        sketch position, the state of the positions above the current one is
+        kept on an explicit stack of tuples.
+        
+        Ambiguous expressions (e.g. %ident%x%ident%) can arrive at the same
+        sketch position and address offset by different routes. The matches from
+        there on are the same regardless, so they are memoized on (i, start_pos).
+        
+        The literals in the sketch are strings; for account and alias substitution
+        see Sketch.materialize(). index is an AddressIndex for the address, which
+        is created if not supplied.
         
         Return value:
             An IdentifierList of lists for all possible matches.
@@ -384,53 +587,101 @@ class MatchExpression(object):
         
         # All subsequent tests have implicitly tested the starting lit.
         if start_pos == 0:
-            literal = str(sketch[i])
+            literal = sketch[i]
             if not address.startswith(literal):
                 return IdentifierList(False)
             start_pos = len(literal)
-        if i >= (len(sketch)-1):
-            return IdentifierList(True)
 
-        end_lit = (len(sketch) > (i + 2)) and str(sketch[i+2]) or None
+        if index is None:
+            index = AddressIndex(address)
+        stack = []
+        memo = {}
+        end_lit, followers = self.follows(sketch, i, index)
         end_offset = start_pos
-        
         matches = IdentifierList(False)
-        matched = BasicBooleanResult()
         
-        while end_offset < len(address):
+        while True:
 
-            if end_lit:
-                if not (address[end_offset:].startswith(end_lit)
-                    and sketch[i+1](address, start_pos, end_offset-1)
-                       ):
-                    end_offset += 1
-                    continue
+            # Find the next place where sketch[i+1] can end.
+            ident_value = None
+            while end_offset < len(address):
 
-                ident_value = address[start_pos:end_offset]
-                end_offset += len(end_lit)
-            else:
-                end_offset += 1
-                if not sketch[i+1](address, start_pos, end_offset-1):
-                    continue
+                if end_lit:
+                    # Jump to the next place the literal occurs.
+                    end_offset = index.find(end_lit, end_offset)
+                    if end_offset < 0:
+                        break
+                    if not sketch[i+1].check_range(index, start_pos, end_offset-1):
+                        end_offset += 1
+                        continue
 
-                ident_value = address[start_pos:end_offset]
+                    ident_value = address[start_pos:end_offset]
+                    end_offset += len(end_lit)
+                else:
+                    if followers is None:
+                        end_offset = len(address)
+                    else:
+                        end_offset += 1
+                    if end_offset < len(address) and not followers[end_offset]:
+                        continue
+                    if not sketch[i+1].check_range(index, start_pos, end_offset-1):
+                        continue
+
+                    ident_value = address[start_pos:end_offset]
+                break
             
-            if matched(self.match_sketch(sketch, address, i+2, end_offset)).success:
-                matches.append( sketch[i+1], ident_value, matched.result)
-        
-        if PRINT_MATCH_SKETCH:
-            PRINT_MATCH_SKETCH('  {}{}'.format(' '*i, matches))
-        return matches
+            if ident_value is None:
+                # Exhausted; pop back up to the previous position.
+                if PRINT_MATCH_SKETCH:
+                    PRINT_MATCH_SKETCH('  {}{}'.format(' '*i, matches))
+                if not stack:
+                    return matches
+                # The last Matcher is cheap to redo; only memoize when there's more to it.
+                if (i + 3) < len(sketch):
+                    memo[(i, start_pos)] = matches
+                matched = matches
+                i, start_pos, end_offset, end_lit, followers, matches, ident_value = stack.pop()
+                if matched:
+                    matches.append( sketch[i+1], ident_value, matched )
+                continue
+
+            if PRINT_MATCH_SKETCH:
+                PRINT_MATCH_SKETCH('  {}{}  {},{}'.format(' '*(i+2), sketch, i+2, end_offset))
+            at_the_end = 0
+            at_the_end += (i + 3) >= len(sketch)
+            at_the_end += end_offset >= len(address)
+            if at_the_end:
+                if at_the_end == 2:
+                    matches.append( sketch[i+1], ident_value, IdentifierList(True) )
+                continue
+            matched = memo.get((i+2, end_offset))
+            if matched is not None:
+                if matched:
+                    matches.append( sketch[i+1], ident_value, matched )
+                continue
+            
+            # Descend to the next position.
+            stack.append( (i, start_pos, end_offset, end_lit, followers, matches, ident_value) )
+            i += 2
+            start_pos = end_offset
+            end_lit, followers = self.follows(sketch, i, index)
+            matches = IdentifierList(False)
     
     def match(self, calc, accounts, aliases, address):
         """Tests whether or not the passed address can be resolved to a deliverable address or not."""
         if PRINT_MATCH_ENTRY:
             PRINT_MATCH_ENTRY('{}... {}  {}'.format(self.expression_,accounts,aliases))
+        # The prescan checks the fixed prefix and suffix first.
+        if not self.prescan(address):
+            return []
+        index = AddressIndex(address)
+        if not self.feasible(address, index):
+            return []
         try:
             # First do a quick test to see if we can match the sketch.
             # The way this works is we do generalized matching after anchoring literals.
             
-            if not self.match_sketch(self.sketch, address):
+            if not self.match_sketch(self.sketch, address, index=index):
                 return []
             
         except MatchFailed:
@@ -439,13 +690,14 @@ class MatchExpression(object):
         # If that works, do it for real. This involves replacing occurrences of "account"
         # or "alias" with actual values and re-running the sketch for each combination.
         matches = []
-        sketch = Sketch(self.sketch)
+        calc_cache = {}
+        sketch = self.account_sketch
         for account in accounts or ['']:
             for alias in aliases or ['']:
                 try:
                     if PRINT_MATCH_SKETCH:
-                        PRINT_MATCH_SKETCH('             sketch.using({}, {})'.format(account,alias))
-                    matched = self.match_sketch( sketch.using( account, alias ), address)
+                        PRINT_MATCH_SKETCH('             sketch.materialize({}, {})'.format(account,alias))
+                    matched = self.match_sketch( sketch.materialize( account, alias ), address, index=index)
                     if PRINT_MATCH_SKETCH:
                         PRINT_MATCH_SKETCH('               matched {}'.format(matched))
                     if not matched:
@@ -459,7 +711,7 @@ class MatchExpression(object):
                             continue
                         if PRINT_CALC_CODE:
                             PRINT_CALC_CODE('               calculating {}, {}'.format(code, idents))
-                        if calc.calculate(code, idents, account, alias):
+                        if calc.calculate(code, idents, account, alias, calc_cache):
                             if PRINT_CALC_CODE:
                                 PRINT_CALC_CODE('               verified! {}, {}'.format(code, idents))
                             verified.append(idents)
@@ -471,13 +723,24 @@ class MatchExpression(object):
         return matches
 
 class Subscriptable(object):
-    """Encapsulates the notion that the subscript argument can be a subscript or account/alias."""
-    NONINTEGER_PARAM_VALUES = set('account alias'.split())
+    """Encapsulates the notion that the subscript argument can be a subscript or account/alias.
+    
+    NOT THREAD SAFE. CalcExpression reuses one of these, calling reset() for each
+    calculation.
+    """
+    NONINTEGER_PARAM_VALUES = frozenset('account alias'.split())
+    __slots__ = ('identifiers', 'account', 'alias', 'masks')
 
     def __init__(self, identifiers, account, alias):
+        self.masks = {}
+        self.reset(identifiers, account, alias)
+        return
+    
+    def reset(self, identifiers, account, alias):
         self.identifiers = identifiers
         self.account = account
         self.alias = alias
+        self.masks.clear()
         return
     
     @property
@@ -485,6 +748,12 @@ class Subscriptable(object):
         return len(self.identifiers)
     
     def get(self, subscript):
+        """Returns the Identifier for the subscript.
+        
+        Subscripts are normally ints, having been converted by semantic_check().
+        """
+        if subscript.__class__ is int:
+            return self.identifiers[subscript-1]
         subscript = subscript.lower()
         if   subscript == 'account':
             return Identifier('account', self.account)
@@ -492,49 +761,63 @@ class Subscriptable(object):
             return Identifier('alias', self.alias)
         return self.identifiers[int(subscript)-1]
     
-DIGITS = set("1234567890")
+    def mask(self, subscript):
+        """Returns a bitmask (see char_mask()) of the characters in the identifier."""
+        mask = self.masks.get(subscript)
+        if mask is None:
+            mask = self.masks[subscript] = char_mask(self.get(subscript).value)
+        return mask
+    
+# Translation tables which delete the characters counted by the counting calcs.
+# What's counted is the difference in length before and after translation.
+DELETE_DIGITS = str.maketrans('', '', "1234567890")
+DELETE_ALPHAS = str.maketrans('', '', 'abcdefghijklmnopqrstuvwxyz')
+DELETE_VOWELS = str.maketrans('', '', 'aeiou')
+
+def count_chars(value, delete_table):
+    """Counts the characters in value which are deleted by delete_table."""
+    return len(value) - len(value.translate(delete_table))
+
 def func_digits(code,args,identifiers):
-    i = args and args[0] or '1'
-    return str(sum(( c in DIGITS for c in identifiers.get(i).value )))
+    i = args and args[0] or 1
+    return str(count_chars(identifiers.get(i).value, DELETE_DIGITS))
 
-ALPHAS = set('abcdefghijklmnopqrstuvwxyz')
 def func_alphas(code,args,identifiers):
-    i = args and args[0] or '1'
-    return str(sum(( c in ALPHAS for c in identifiers.get(i).value )))
+    i = args and args[0] or 1
+    return str(count_chars(identifiers.get(i).value, DELETE_ALPHAS))
 
 def func_labels(code,args,identifiers):
-    i = args and args[0] or '1'
+    i = args and args[0] or 1
     if identifiers.get(i).type != 'fqdn':
         return None
     return str(len(identifiers.get(i).value.split('.')))
     
 def func_chars(code,args,identifiers):
-    i = args and args[0] or '1'
+    i = args and args[0] or 1
     return str(len(identifiers.get(i).value))
 
-VOWELS = set('aeiou')
 def func_vowels(code,args,identifiers):
-    i = args and args[0] or '1'
-    return str(sum(( c in VOWELS for c in identifiers.get(i).value )))
+    i = args and args[0] or 1
+    return str(count_chars(identifiers.get(i).value, DELETE_VOWELS))
 
 def func_any(code,args,identifiers):
-    i = args and args[0] or '1'
-    return code[0] in identifiers.get(i).value and code[0] or None
+    i = args and args[0] or 1
+    return (identifiers.mask(i) >> ord(code[0])) & 1 and code[0] or None
 
 def func_none(code,args,identifiers):
-    i = args and args[0] or '1'
-    return code[0] not in identifiers.get(i).value and code[0] or None
+    i = args and args[0] or 1
+    return not (identifiers.mask(i) >> ord(code[0])) & 1 and code[0] or None
 
 def func_char(code,args,identifiers):
     """ This is the only one which has more than one possible argument..."""
     args = TestableIterator(args)
     
     if len(args) == 4 or (  len(args) == 3
-                        and (identifiers.n_identifiers != 1 or identifiers.get('1').type != 'fqdn')
+                        and (identifiers.n_identifiers != 1 or identifiers.get(1).type != 'fqdn')
                          ):
         i = args.next()
     else:
-        i = '1'
+        i = 1
 
     label = identifiers.get(i).type == 'fqdn' and args.next() or 0
     
@@ -561,9 +844,11 @@ class CalcExpression(object):
     
     Does a few arguably pointless things to be DWIMmy, such as being subscriptable.
     """
+    __slots__ = ('calcs_', 'line_number', 'subscriptable', 'ops')
     
     def __init__(self):
         self.calcs_ = []
+        self.subscriptable = Subscriptable([], '', '')
         return
     
     def __getitem__(self,i):
@@ -596,91 +881,123 @@ class CalcExpression(object):
         Chiefly this consists of checking reference bounds and number of arguments.
         Some things cannot be caught (e.g. label indices) as they are dependent on the
         input (account) being matched.
+        
+        Each function is checked by its entry in VALIDATORS, defaulting to
+        check_function().
         """
-        n_identifiers = matchex.identifiers
         for calc in self.calcs:
-            func = calc[0]
-            args = calc[1:]
-            needs_ident_subscript = n_identifiers > 1
-            first_arg_is_label = False
-            if func == 'CHAR':
-                if len(args) > 4:
-                    self.semantic_error('{} requires at most 4 arguments with {}'.format(func, matchex.expression))
-                if needs_ident_subscript:
-                    if len(args) < 3:
-                        self.semantic_error('{} requires an identifier subscript with {}'.format(func, matchex.expression))
-                    if len(args) == 4:
-                        try:
-                            i_ident = int(args[0])
-                        except ValueError:
-                            i_ident = -1
-                        if i_ident not in matchex.fqdns:
-                            self.semantic_error('{} index {} does not reference an fqdn in {}'.format(func, i_ident, matchex.expression))
-                    else:
-                        if args[0].lower() not in Subscriptable.NONINTEGER_PARAM_VALUES:
-                            try:
-                                i_ident = int(args[0])
-                            except ValueError:
-                                i_ident = -1
-                            if i_ident < 1 or i_ident > n_identifiers:
-                                self.semantic_error('{} index must be between 1 and {} with {}'.format(func, n_identifiers, matchex.expression))
-                            if i_ident in matchex.fqdns:
-                                self.semantic_error('{} index {} references an fqdn and needs a label index with {}'.format(func, i_ident, matchex.expression))
-                        elif args[0].lower() == 'alias' and not aliases:
-                            self.semantic_error('"alias" referenced in {} but no aliases present.'.format(matchex.expression))
-                else:
-                    if len(args) < 2:
-                        self.semantic_error('{} requires at least 2 arguments with {}'.format(func, matchex.expression))
-                    if 1 in matchex.fqdns:
-                        try:
-                            int(args[len(args)-3])
-                        except ValueError:
-                            self.semantic_error('{} requires numeric label index with {}'.format(func, matchex.expression))
-                        if len(args) == 4:
-                            try:
-                                i_ident = int(args[0])
-                            except ValueError:
-                                i_ident = -1
-                            if i_ident != 1:
-                                self.semantic_error('{} requires index of 1 with {}'.format(func, matchex.expression))
-                        else:
-                            first_arg_is_label = True
-                    else:
-                        if len(args) == 4:
-                            self.semantic_error('{} must not have a label argument with {}'.format(func, matchex.expression))
-                        if len(args) == 3:
-                            if args[0].lower() not in Subscriptable.NONINTEGER_PARAM_VALUES:
-                                try:
-                                    i_ident = int(args[0])
-                                except ValueError:
-                                    i_ident = -1
-                                if i_ident < 1 or i_ident > n_identifiers:
-                                    self.semantic_error('{} index must be between 1 and {} with {}'.format(func, n_identifiers, matchex.expression))                            
-                            elif args[0].lower() == 'alias' and not aliases:
-                                self.semantic_error('"alias" referenced in {} but no aliases present.'.format(matchex.expression))
-                # Preconvert label index and character offset to int, but not identifier index.
+            self.VALIDATORS.get(calc[0], CalcExpression.check_function)(self, calc, matchex, aliases)
+        # Read only from here on.
+        self.calcs_ = tuple(self.calcs_)
+        self.compile_ops()
+        return
+    
+    def check_subscript(self, func, subscript, matchex, aliases):
+        """Checks an identifier subscript.
+        
+        Returns the subscript as an int, or else (lowercased) account / alias.
+        """
+        if subscript.__class__ is str and subscript.lower() in Subscriptable.NONINTEGER_PARAM_VALUES:
+            subscript = subscript.lower()
+            if subscript == 'alias' and not aliases:
+                self.semantic_error('"alias" referenced in {} but no aliases present.'.format(matchex.expression))
+            return subscript
+        try:
+            i_ident = int(subscript)
+        except ValueError:
+            i_ident = -1
+        if i_ident < 1 or i_ident > matchex.identifiers:
+            self.semantic_error('{} index must be between 1 and {} with {}'.format(func, matchex.identifiers, matchex.expression))
+        return i_ident
+    
+    def check_function(self, calc, matchex, aliases):
+        """Checks a function with at most one argument, an identifier subscript."""
+        func = calc[0]
+        args = calc[1:]
+        if len(args) > 1:
+            self.semantic_error('{} requires at most 1 argument with {}'.format(func, matchex.expression))
+        if matchex.identifiers > 1 and len(args) < 1:
+            self.semantic_error('{} requires an identifier subscript with {}'.format(func, matchex.expression))
+        if len(args):
+            calc[1] = self.check_subscript(func, args[0], matchex, aliases)
+        return
+    
+    def check_char(self, calc, matchex, aliases):
+        """Checks CHAR(), which has up to 4 arguments: identifier, label, character, default.
+        
+        Which arguments are required depends on how many identifiers there are, and
+        whether they are fqdns (which need a label index).
+        """
+        func = calc[0]
+        args = calc[1:]
+        first_arg_is_label = False
+        if len(args) > 4:
+            self.semantic_error('{} requires at most 4 arguments with {}'.format(func, matchex.expression))
+        if matchex.identifiers > 1:
+            if len(args) < 3:
+                self.semantic_error('{} requires an identifier subscript with {}'.format(func, matchex.expression))
+            if len(args) == 4:
                 try:
-                    calc[-2] = int(calc[-2])
-                    if len(args) == 4 or first_arg_is_label:
-                        calc[-3] = int(calc[-3])
+                    i_ident = int(args[0])
                 except ValueError:
-                    self.semantic_error('{} has invalid label or character index in {}'.format(func, matchex.expression))
+                    i_ident = -1
+                if i_ident not in matchex.fqdns:
+                    self.semantic_error('{} index {} does not reference an fqdn in {}'.format(func, i_ident, matchex.expression))
             else:
-                if len(args) > 1:
-                    self.semantic_error('{} requires at most 1 argument with {}'.format(func, matchex.expression))
-                if needs_ident_subscript:
-                    if len(args) < 1:
-                        self.semantic_error('{} requires an identifier subscript with {}'.format(func, matchex.expression))
-                if len(args):
-                    if args[0].lower() not in Subscriptable.NONINTEGER_PARAM_VALUES:
-                        try:
-                            i_ident = int(args[0])
-                        except ValueError:
-                            i_ident = -1
-                        if i_ident < 1 or i_ident > n_identifiers:
-                            self.semantic_error('{} index must be between 1 and {} with {}'.format(func, n_identifiers, matchex.expression))                            
-                    elif args[0].lower() == 'alias' and not aliases:
-                        self.semantic_error('"alias" referenced in {} but no aliases present.'.format(matchex.expression))
+                i_ident = self.check_subscript(func, args[0], matchex, aliases)
+                if i_ident in matchex.fqdns:
+                    self.semantic_error('{} index {} references an fqdn and needs a label index with {}'.format(func, i_ident, matchex.expression))
+            calc[1] = i_ident
+        else:
+            if len(args) < 2:
+                self.semantic_error('{} requires at least 2 arguments with {}'.format(func, matchex.expression))
+            if 1 in matchex.fqdns:
+                try:
+                    int(args[len(args)-3])
+                except ValueError:
+                    self.semantic_error('{} requires numeric label index with {}'.format(func, matchex.expression))
+                if len(args) == 4:
+                    try:
+                        i_ident = int(args[0])
+                    except ValueError:
+                        i_ident = -1
+                    if i_ident != 1:
+                        self.semantic_error('{} requires index of 1 with {}'.format(func, matchex.expression))
+                    calc[1] = i_ident
+                else:
+                    first_arg_is_label = True
+            else:
+                if len(args) == 4:
+                    self.semantic_error('{} must not have a label argument with {}'.format(func, matchex.expression))
+                if len(args) == 3:
+                    calc[1] = self.check_subscript(func, args[0], matchex, aliases)
+        # Preconvert label index and character offset to int; the identifier index has
+        # been converted by check_subscript() (or else directly).
+        try:
+            calc[-2] = int(calc[-2])
+            if len(args) == 4 or first_arg_is_label:
+                calc[-3] = int(calc[-3])
+        except ValueError:
+            self.semantic_error('{} has invalid label or character index in {}'.format(func, matchex.expression))
+        return
+    
+    VALIDATORS = dict(
+                CHAR=check_char
+        )
+    
+    def compile_ops(self):
+        """Compiles the calcs into the ops which calculate() performs.
+        
+        Each op is a (name, function, args, subscript, cacheable) tuple. The
+        subscript is only meaningful for IDENTIFIER_FUNCS, which are cacheable.
+        """
+        ops = []
+        for calc in self.calcs_:
+            args = tuple(calc[1:])
+            ops.append( ( calc[0], self.FUNCS[calc[0]], args,
+                          args and args[0] or 1, calc[0] in self.IDENTIFIER_FUNCS
+                      ) )
+        self.ops = tuple(ops)
         return
     
     FUNCS = dict(
@@ -693,8 +1010,11 @@ class CalcExpression(object):
                 NONE=func_none,
                 CHAR=func_char
         )
+    # These depend on nothing but the one identifier they reference, so their
+    # results can be memoized on the identifier.
+    IDENTIFIER_FUNCS = frozenset(( 'DIGITS', 'ALPHAS', 'LABELS', 'CHARS', 'VOWELS' ))
 
-    def calculate(self, code, identifiers, account, alias):
+    def calculate(self, code, identifiers, account, alias, cache=None):
         """Calculate the verification code from the list of Identifiers.
         
         Parameters
@@ -704,36 +1024,54 @@ class CalcExpression(object):
             identifiers A list of Identifiers.
             account     The account.
             alias       The alias.
+            cache       Optional dictionary memoizing IDENTIFIER_FUNCS results.
+                        The same identifier values are typically seen over and
+                        over while matching one address. If not supplied, results
+                        are still memoized for the duration of the call.
 
         True if the calculated code matches the passed code. In particular, ANY()
         requires prior knowledge of the code being computed.
         
         Technically speaking, the "True" value is the built code string.
         """
+        if cache is None:
+            cache = {}
         code = code.value
-        results = []
-        identifiers = Subscriptable(identifiers, account, alias)
+        code_length = len(code)
+        consumed = 0
+        self.subscriptable.reset(identifiers, account, alias)
+        identifiers = self.subscriptable
         # The way that this works is that we consume the (passed) code and achieve success
-        # if we run out at the same time we run out of functions to call.
-        for calc in self.calcs:
-            if not code:
+        # if we run out at the same time we run out of functions to call. Rather than
+        # slicing off what's been consumed, we keep track of how much of it has been;
+        # the functions only ever look at the next character of the code.
+        for name, func, args, subscript, cacheable in self.ops:
+            if consumed >= code_length:
                 return False
-            fv = self.FUNCS[calc[0]]( code, calc[1:], identifiers )
+            if cacheable:
+                ident = identifiers.get(subscript)
+                key = (name, ident.type, ident.value)
+                if key in cache:
+                    fv = cache[key]
+                else:
+                    fv = cache[key] = func( code[consumed], args, identifiers )
+            else:
+                fv = func( code[consumed], args, identifiers )
             if PRINT_CALC_VALUE:
-                PRINT_CALC_VALUE('{}({},{}) -> {}'.format(calc[0], code, calc[1:], fv))
+                PRINT_CALC_VALUE('{}({},{}) -> {}'.format(name, code[consumed:], args, fv))
             if not fv:
                 return False
-            if code.startswith(fv):
-                code = code[len(fv):]
+            if code.startswith(fv, consumed):
+                consumed += len(fv)
             else:
                 return False
-            results.append(fv)
         
         # Shouldn't be anything left over.
-        if code:
+        if consumed != code_length:
             return False
         
-        return ''.join(results)
+        # Everything matched, so the built code is the code itself.
+        return code
 
 class Alias(object):
     """A single alias specification.
@@ -745,6 +1083,7 @@ class Alias(object):
       matchex:          the match expression
       calc:             the calculation
     """
+    __slots__ = ('accounts', 'aliases', 'matchex', 'calc')
     
     def __init__(self):
         self.accounts = []
@@ -20,10 +20,14 @@ from_text() is provided to parse a configuration from text.
 """
 
 import logging
+import copy
+from sys import intern
+from collections import Counter, defaultdict, OrderedDict
+from functools import lru_cache
 
-from .config_base import ConfigurationError, Loader, DEFAULT_CONFIG
-from .alias import SemanticError
-from .parser import StreamParsingLoader
+from .config_base import ConfigurationError, Loader, DEFAULT_CONFIG, DEFAULT_SETTINGS
+from .alias import SemanticError, Alias
+from .parser import MultilineStringLoader
 
 class ReloadError(ConfigurationError):
     """Calling reload() in the preprocessor context failed."""
@@ -32,18 +36,77 @@ class ReloadError(ConfigurationError):
 def from_text(stream,raise_on_error=False):
     """Convenience method loads a Configuration.
     
-    Accepts either a stream/filehandle object (which can be turned into an
-    instance of StreamParsingLoader) or else an instance of a subclass
-    of Loader.
+    Accepts either a stream/filehandle object or else an instance of a subclass
+    of Loader. The contents of a stream are read and loaded with from_string(),
+    so that reloading the same text doesn't parse it again.
     """
-    if not isinstance(stream, Loader):
-        stream = StreamParsingLoader(stream)
+    if isinstance(stream, Loader):
+        return Configuration().load(stream, raise_on_error)
         
-    return Configuration().load(stream, raise_on_error)
+    return from_string(stream.read(), raise_on_error)
+
+@lru_cache(maxsize=128)
+def parsed_string(text):
+    """Parses a multiline string, memoizing what the parser produced.
+    
+    Only immutable data is memoized: the settings as a tuple of items, and a
+    tuple of (accounts, aliases, account_matcher, expression, calcs) for each
+    alias specification. The expression and calcs are (value, line_number)
+    tuples, as the parser supplies them. See MemoizedStringLoader.
+    """
+    config = MultilineStringLoader(text).load()
+    specs = tuple(
+            ( tuple(spec.accounts), tuple(spec.aliases), spec.matchex.account_matcher,
+              (spec.matchex.expression, spec.matchex.line_number),
+              (tuple( tuple(calc) for calc in spec.calc.calcs ), spec.calc.line_number)
+            )
+            for spec in config.pop('aliases')
+        )
+    return tuple(config.items()), specs
+
+class MemoizedStringLoader(Loader):
+    """Loads a multiline string, parsing it only the first time it's seen.
+    
+    The parse is memoized by parsed_string(); every load() builds fresh Alias
+    specifications from it, so nothing mutable is shared between Configurations.
+    """
+    def __init__(self, text):
+        self.text = text
+        return
+    
+    def load(self):
+        settings, specs = parsed_string(self.text)
+        config = dict(settings)
+        config['aliases'] = aliases = []
+        for accounts, spec_aliases, account_matcher, expression, calcs in specs:
+            spec = Alias()
+            spec.accounts = list(accounts)
+            spec.aliases = list(spec_aliases)
+            spec.matchex.account_matcher = account_matcher
+            spec.matchex.expression = expression
+            spec.calc.calcs = ([ list(calc) for calc in calcs[0] ], calcs[1])
+            aliases.append(spec)
+        return config
+
+def from_string(text, raise_on_error=False):
+    """Convenience method loads a Configuration from a multiline string.
+    
+    Parsing is memoized on the text, so that loading the same text repeatedly
+    (tests do this a lot) only parses it once. See MemoizedStringLoader.
+    """
+    return Configuration().load(MemoizedStringLoader(text), raise_on_error)
         
 class Configuration(object):
     """A Configuration and the means to query it."""
     
+    # Server settings, available as attributes.
+    SETTINGS = tuple(DEFAULT_SETTINGS)
+    
+    __slots__ = ('config', 'error', 'accounts', 'aliases', 'alias_accounts', 'account_aliases', 'alias_account_count', 'account_trie', 'spec_literals', 'prefix_trie', 'found') + SETTINGS
+    
+    # The most lookup.find() results remembered at any one time.
+    FOUND_CACHE_SIZE = 4096
+    
     def __init__(self):
         """Create an empty, default configuration.
         
@@ -52,35 +115,43 @@ class Configuration(object):
         """
         self.config = DEFAULT_CONFIG()
         self.error = 'Not configured.'
+        self.accounts = {}
+        self.aliases = {}
+        self.alias_accounts = {}
+        self.account_aliases = {}
+        self.alias_account_count = {}
+        self.account_trie = {}
+        self.spec_literals = []
+        self.prefix_trie = {}
+        self.refresh_settings()
         return
     
-    @property
-    def host(self):
-        return self.config['host']
-    
-    @property
-    def port(self):
-        return self.config['port']
-    
-    @property
-    def logging(self):
-        return self.config['logging']
-    
-    @property
-    def debug_account(self):
-        return self.config['debug_account']
-    
-    @property
-    def statistics(self):
-        return self.config['statistics']
-    
-    @property
-    def python_is_311(self):
-        return self.config['python_is_311']
+    def refresh_settings(self):
+        """Copies the server settings from the config dictionary to attributes.
+        
+        This is done by update_config() (and so load()) and copy(); call it again
+        if the config dictionary is changed directly. Settings missing from the
+        config dictionary take their defaults.
+        
+        FLUENT: returns the object.
+        """
+        config = self.config
+        for setting in self.SETTINGS:
+            setattr(self, setting, config.get(setting, DEFAULT_SETTINGS[setting]))
+        # Results can depend on the settings (debug_account).
+        self.found = OrderedDict()
+        return self
     
-    @property
-    def processor(self):
-        return self.config['processor']
+    def copy(self):
+        """Returns a shallow copy of the Configuration.
+        
+        The config dictionary and its list of aliases are copied, so that they
+        can be updated without affecting the original. The Alias specifications
+        themselves are shared.
+        """
+        configuration = copy.copy(self)
+        configuration.config = dict(self.config, aliases=list(self.config['aliases']))
+        return configuration.refresh_settings()
     
     def build_maps(self):
         """Builds the internal maps used by lookup methods.
@@ -88,42 +159,77 @@ class Configuration(object):
         FLUENT: returns the object.
         """
         # Determine which match expressions are unique.
-        expressions = {}
-        for expr in (spec.matchex for spec in self.config['aliases']):
-            if expr.expression_ in expressions:
-                expressions[expr.expression_] += 1
-            else:
-                expressions[expr.expression_] = 1
-        for expr in (spec.matchex for spec in self.config['aliases']):
-            expr.unique = expressions[expr.expression_] == 1
+        expressions = Counter(spec.matchex.expression_ for spec in self.config['aliases'])
+        for spec in self.config['aliases']:
+            spec.matchex.unique = expressions[spec.matchex.expression_] == 1
             
         # Determine which accounts / aliases are referenced by which account declarations.
-        self.accounts = {}
-        self.aliases = {}
-        self.alias_accounts = {}
+        accounts = defaultdict(list)
+        aliases = defaultdict(list)
+        alias_accounts = defaultdict(set)
         for spec in self.config['aliases']:
-            for ident in spec.accounts:
-                if ident in self.accounts:
-                    self.accounts[ident].append(spec)
-                else:
-                    self.accounts[ident] = [spec]
-            for ident in spec.aliases:
-                if ident in self.aliases:
-                    self.aliases[ident].append(spec)
-                    self.alias_accounts[ident] |= set(spec.accounts)
-                else:
-                    self.aliases[ident] = [spec]
-                    self.alias_accounts[ident] = set(spec.accounts)
+            # Interned, since these are hashed over and over as keys.
+            spec_accounts = spec.accounts = [ intern(ident) for ident in spec.accounts ]
+            spec_aliases = spec.aliases = [ intern(ident) for ident in spec.aliases ]
+            for ident in spec_accounts:
+                accounts[ident].append(spec)
+            for ident in spec_aliases:
+                aliases[ident].append(spec)
+                alias_accounts[ident].update(spec_accounts)
+        # Plain dicts, so that lookups of unknown accounts / aliases still fail.
+        self.accounts = dict(accounts)
+        self.aliases = dict(aliases)
+        # Immutable, since these are handed out by associated_accounts() / associated_aliases().
+        self.alias_accounts = { alias: frozenset(accounts) for alias, accounts in alias_accounts.items() }
+        self.account_aliases = { account: frozenset( alias for spec in specs for alias in spec.aliases )
+                                 for account, specs in self.accounts.items()
+                               }
+        self.alias_account_count = { alias: len(accounts) for alias, accounts in self.alias_accounts.items() }
+        
+        # A trie of the account names, for scan_address(). Each node is a dictionary
+        # of the next characters, with the account under '' if the node ends one.
+        self.account_trie = {}
+        for account in self.accounts:
+            node = self.account_trie
+            for c in account:
+                node = node.setdefault(c, {})
+            node[''] = account
+        
+        # For lookup.prescreen(): the (nonempty) literals each match expression requires,
+        # and the accounts one of which is required if the expression has %account%.
+        self.spec_literals = [ ( spec,
+                                 tuple(set( literal for literal in spec.matchex.literals if literal )),
+                                 'account' in spec.matchex.matchvalues and frozenset(spec.accounts) or None
+                               )
+                               for spec in self.config['aliases']
+                             ]
+        # Also for prescreen(): a trie like account_trie of the literals the match
+        # expressions start with, with the indices into spec_literals of the
+        # expressions starting with a node's prefix under ''.
+        self.prefix_trie = {}
+        for i, spec in enumerate(self.config['aliases']):
+            node = self.prefix_trie
+            for c in spec.matchex.literals[0]:
+                node = node.setdefault(c, {})
+            node.setdefault('', []).append(i)
+        
+        # Memoized lookup.find() results, least recently used first.
+        self.found = OrderedDict()
                 
         return self
     
     def update_config(self, new_config):
         """Update the current config with the contents of the new one.
         
+        The maps are only rebuilt if the new config supplies aliases; updates
+        to just the settings leave them alone.
+        
         FLUENT: returns the object.
         """
         self.config.update(new_config)
-        self.build_maps()
+        self.refresh_settings()
+        if 'aliases' in new_config:
+            self.build_maps()
         return self
     
     def semantic_check(self):
@@ -134,15 +240,39 @@ class Configuration(object):
     
     def associated_aliases(self, account):
         """Return the aliases associated with an account."""
-        aliases = []
-        for spec in self.accounts[account]:
-            aliases += spec.aliases
-        return set(aliases)
+        return self.account_aliases[account]
         
     def associated_accounts(self, alias):
         """Return the accounts associated with an alias."""
         return self.alias_accounts[alias]
     
+    def scan_address(self, address):
+        """Returns where accounts occur in the address.
+        
+        The return value is a list of (start_pos, end_pos, account) for every
+        occurrence (end_pos is inclusive). The account trie is walked from each
+        position in the address, so this is one pass over the address for every
+        account.
+        """
+        occurrences = []
+        trie = self.account_trie
+        for start_pos in range(len(address)):
+            node = trie
+            for end_pos in range(start_pos, len(address)):
+                node = node.get(address[end_pos])
+                if node is None:
+                    break
+                if '' in node:
+                    occurrences.append((start_pos, end_pos, node['']))
+        return occurrences
+    
+    def ambiguity_error(self, reason, spec):
+        """Raises a SemanticError because the spec is ambiguous."""
+        matchex = spec.matchex
+        raise SemanticError('Ambiguous because {} {}'.format(reason, matchex.expression_),
+                            additional=dict(line_number=matchex.line_number)
+                           )
+    
     def enforce_uniqueness(self):
         """Enforce semantic requirements for uniqueness.
         
@@ -158,13 +288,28 @@ class Configuration(object):
         FEEDBACK / TEST CASES ENCOURAGED: This is all about edge cases. The cases considered
         here are probably safe, and also probably overly restrictive.
         """
+        # (has 'account', has 'alias', unique) for each spec's match expression.
+        spec_flags = {}
+        for spec in self.config['aliases']:
+            matchex = spec.matchex
+            matchvalues = matchex.matchvalues
+            spec_flags[spec] = ( 'account' in matchvalues, 'alias' in matchvalues, matchex.unique )
+        
+        alias_account_count = self.alias_account_count
+        account_aliases = self.account_aliases
         
         # ACCOUNTS...
-        for account in self.accounts:
+        for account, specs in self.accounts.items():
             
-            associated_aliases = self.associated_aliases(account)
+            associated_aliases = account_aliases[account]
+            # The account has one alias, which has one account.
+            uniquely_paired = ( len(associated_aliases) == 1
+                                and alias_account_count[next(iter(associated_aliases))] == 1
+                              )
             
-            for spec in self.accounts[account]:
+            for spec in specs:
+                
+                has_account, has_alias, unique = spec_flags[spec]
 
                 # Has no aliases.
                 #
@@ -174,11 +319,9 @@ class Configuration(object):
                 #     * matchex is unique
                 #
                 if not associated_aliases:
-                    if 'account' in spec.matchex.tokens or spec.matchex.unique:
+                    if has_account or unique:
                         continue
-                    raise SemanticError('Ambiguous because the account is not present and expression not unique {}'.format(spec.matchex.expression_),
-                                        additional=dict(line_number=spec.matchex.line_number)
-                                       )
+                    self.ambiguity_error('the account is not present and expression not unique', spec)
                     
                 # Account and alias are uniquely paired.
                 #
@@ -193,12 +336,10 @@ class Configuration(object):
                 #     or
                 #       * matchex is unique
                 #
-                if len(associated_aliases) == 1 and len(self.associated_accounts(tuple(associated_aliases)[0])) == 1:
-                    if 'account' in spec.matchex.tokens or 'alias' in spec.matchex.tokens or spec.matchex.unique:
+                if uniquely_paired:
+                    if has_account or has_alias or unique:
                         continue
-                    raise SemanticError('Ambiguous because neither account or alias is present and expression not unique {}'.format(spec.matchex.expression_),
-                                        additional=dict(line_number=spec.matchex.line_number)
-                                       )
+                    self.ambiguity_error('neither account or alias is present and expression not unique', spec)
 
                 # Many aliases
                 # 
@@ -209,13 +350,13 @@ class Configuration(object):
                 #     or
                 #       * no aliases for this spec (some other spec has aliases)
                 #
-                for alias in associated_aliases:
-                    if len(self.associated_accounts(tuple(associated_aliases)[0])) == 1:
-                        if 'alias' in spec.matchex.tokens or not spec.aliases:
-                            continue
-                        raise SemanticError('Ambiguous because alias is not present {}'.format(spec.matchex.expression_),
-                                            additional=dict(line_number=spec.matchex.line_number)
-                                       )
+                # This applies to each of the aliases, so it's enough that any one of them
+                # has one account.
+                #
+                if has_alias or not spec.aliases:
+                    continue
+                if any( alias_account_count[alias] == 1 for alias in associated_aliases ):
+                    self.ambiguity_error('alias is not present', spec)
 
         # ALIASES
         
@@ -226,18 +367,15 @@ class Configuration(object):
         #   and
         #     * 'alias' in matchex
         #
-        for alias in self.aliases:
-
-            if len(self.associated_accounts(alias)) < 2:
-                continue
+        multi_account_aliases = [ alias for alias, count in alias_account_count.items() if count > 1 ]
+        for alias in multi_account_aliases:
         
             for spec in self.aliases[alias]:
                 
-                if 'account' in spec.matchex.tokens and 'alias' in spec.matchex.tokens:
+                has_account, has_alias, unique = spec_flags[spec]
+                if has_account and has_alias:
                     continue
-                raise SemanticError('Ambiguous because account and alias are not present {}'.format(spec.matchex.expression_),
-                                    additional=dict(line_number=spec.matchex.line_number)
-                                )
+                self.ambiguity_error('account and alias are not present', spec)
         return
     
     def processor_reloaded(self):
@@ -255,23 +393,54 @@ class Configuration(object):
             raise ReloadError('{}: {}'.format(type(e).__name__, e))
         return
         
-    def load(self,loader,raise_on_error=False):
-        """Use the loader to update the configuration.
+    def load_error(self, e, raise_on_error):
+        """Records (or raises) an error encountered while loading."""
+        if raise_on_error:
+            raise e
+        self.error = ' {}: {}'.format(type(e).__name__, e)
+        logging.error(self.error)
+        return
+    
+    def reload_processor(self, raise_on_error=False):
+        """Calls processor_reloaded() if there is a processor.
+        
+        Nothing is done if the configuration failed to load.
         
         FLUENT: returns the object.
         """
-        self.error = ''
+        if self.error or self.processor is None:
+            return self
+        try:
+            self.processor_reloaded()
+        except ConfigurationError as e:
+            self.load_error(e, raise_on_error)
+        return self
+        
+    def try_load(self, loader):
+        """Use the loader to update the configuration, without raising.
+        
+        Returns the ConfigurationError (or ValueError) which was encountered, or
+        None if the configuration is valid. This suits validating configurations.
+        """
         try:
             self.update_config(loader.load())
-            self.semantic_check()
+            # Uniqueness doesn't depend on the compiled specs, and is cheaper to check.
             self.enforce_uniqueness()
-            if self.processor is not None:
-                self.processor_reloaded()
+            self.semantic_check()
         except (ConfigurationError, ValueError) as e:
-            if raise_on_error:
-                raise e
-            self.error = ' {}: {}'.format(type(e).__name__, e)
-            logging.error(self.error)
-        return self
+            return e
+        return None
+    
+    def load(self,loader,raise_on_error=False):
+        """Use the loader to update the configuration.
+        
+        FLUENT: returns the object.
+        """
+        self.error = ''
+        error = self.try_load(loader)
+        if error is not None:
+            self.load_error(error, raise_on_error)
+            return self
+        return self.reload_processor(raise_on_error)
 
     
@@ -17,17 +17,29 @@
 
 import sysconfig
 import logging
-from ipaddress import ip_address
+from ipaddress import IPv4Address
+from types import MappingProxyType
 
 PYTHON_IS_311 = int( sysconfig.get_python_version().split('.')[1] ) >= 11
 
 PROCESSOR = None
-HOST = ip_address('127.0.0.1')
+HOST = IPv4Address(0x7F000001)      # 127.0.0.1
 PORT = 3047
 LOGGING = logging.WARNING
 DEBUG_ACCOUNT = None
 STATISTICS = None
 
+# The defaults for the settings in a configuration, see DEFAULT_CONFIG().
+DEFAULT_SETTINGS = MappingProxyType({
+        'python_is_311':    PYTHON_IS_311,
+        'processor':        PROCESSOR,
+        'host':             HOST,
+        'port':             PORT,
+        'logging':          LOGGING,
+        'debug_account':    DEBUG_ACCOUNT,
+        'statistics':       STATISTICS
+    })
+
 class Loader(object):
     """Base class for all config generators/loaders."""
     pass
@@ -41,7 +53,7 @@ class ConfigurationError(Exception):
     
     def __str__(self):
         return '{} ({})'.format(self.reason,
-                                ', '.join('{}:{}'.format(k,str(self.additional[k])) for k in self.additional.keys())
+                                ', '.join([ '{}:{!s}'.format(k, v) for k, v in self.additional.items() ])
                                )
 
 def DEFAULT_CONFIG(minimal=False):
@@ -51,19 +63,8 @@ def DEFAULT_CONFIG(minimal=False):
     config. This dictionary contains defaults for all possible parameters
     for all servers.
     """
-    
+    # Only the list of aliases is mutable; the default settings themselves
+    # (HOST in particular) are shared.
     if minimal:
-        config = dict()
-    else:
-        config = dict(
-                    python_is_311=PYTHON_IS_311,
-                    processor=PROCESSOR,
-                    host=HOST,
-                    port=PORT,
-                    logging=LOGGING,
-                    debug_account=DEBUG_ACCOUNT,
-                    statistics=STATISTICS
-                 )
-    config['aliases'] = []
-    return config
-
+        return { 'aliases': [] }
+    return dict(DEFAULT_SETTINGS, aliases=[])
@@ -27,34 +27,105 @@ class LookupThing(object):
         """This just calls the module level find()."""
         return find(name, self.config)
     
+def prescreen(name, config):
+    """Returns the alias specifications which could possibly match the name.
+    
+    The name has to start with the literal a specification's match expression
+    starts with; walking the prefix trie with the name turns up the ones which
+    do, in one pass.
+    
+    Every literal in a specification's match expression has to occur in the
+    name. The same literals (think "-" or ".") tend to be used by many
+    specifications, so each distinct literal is only looked for once.
+    
+    If the match expression has %account% then one of the specification's
+    accounts has to occur in the name as well. The name is scanned for accounts
+    (once) only if it comes to that.
+    """
+    node = config.prefix_trie
+    indices = list(node.get('', ()))
+    for c in name:
+        node = node.get(c)
+        if node is None:
+            break
+        indices += node.get('', ())
+    # In the order they were configured.
+    indices.sort()
+    spec_literals = config.spec_literals
+    
+    present = {}
+    present_accounts = None
+    candidates = []
+    for i in indices:
+        spec, literals, accounts = spec_literals[i]
+        for literal in literals:
+            found = present.get(literal)
+            if found is None:
+                found = present[literal] = literal in name
+            if not found:
+                break
+        else:
+            if accounts:
+                if present_accounts is None:
+                    present_accounts = set( account for start_pos, end_pos, account in config.scan_address(name) )
+                if present_accounts.isdisjoint(accounts):
+                    continue
+            candidates.append(spec)
+    return candidates
+    
 def find(name, config):
-    """Translate the name to the correct account using the supplied config."""
-    matches = []
-    for spec in config.config['aliases']:
-        matches += spec.match(name)
-        
-    if not matches:
-        return ''
+    """Translate the name to the correct account using the supplied config.
+    
+    The same names tend to be looked up over and over, so the results (and
+    any warning, which is logged every time) are memoized on the config. When
+    there are too many, the least recently used one is forgotten. See
+    resolve().
+    """
+    results = config.found
+    found = results.get(name)
+    if found is None:
+        if len(results) >= config.FOUND_CACHE_SIZE:
+            results.popitem(last=False)
+        found = results[name] = resolve(name, config)
+    else:
+        results.move_to_end(name)
+    delivery_account, warning = found
+    if warning:
+        logging.warning(warning)
+    return delivery_account
 
-    # Check for ambiguity.
+def resolve(name, config):
+    """Does the work for find().
+    
+    Returns the delivery account and a warning, which is None if there is
+    nothing to warn about.
+    """
+    # Check for ambiguity as the matches are found. Once there's no one delivery
+    # account, nothing else which matches can change that.
+    matched = False
     ambiguous = False
     delivery_account = ''    
-    for match in matches:
-        ambiguous |= match.ambiguous()
-        account = match.delivery_account()
-        if account is None or delivery_account and delivery_account != account:
-            delivery_account = None
-        if not delivery_account and delivery_account is not None:
-            delivery_account = account
+    for spec in prescreen(name, config):
+        for match in spec.match(name):
+            matched = True
+            ambiguous |= match.ambiguous()
+            account = match.delivery_account()
+            if account is None or delivery_account and delivery_account != account:
+                delivery_account = None
+                break
+            if not delivery_account:
+                delivery_account = account
+        if delivery_account is None:
+            break
         
+    if not matched:
+        return '', None
+
     # Even if there's ambiguity, we can deliver to the delivery account if there is only
     # one.
     if delivery_account:
         if ambiguous:
-            logging.warning('{} ambiguous but deliverable to {}'.format(name, delivery_account))
-        return delivery_account
+            return delivery_account, '{} ambiguous but deliverable to {}'.format(name, delivery_account)
+        return delivery_account, None
 
-    logging.warning('{} ambiguous, delivered to the debug account {}'.format(name, config.debug_account))
-    return config.debug_account
- 
- 
\ No newline at end of file
+    return config.debug_account, '{} ambiguous, delivered to the debug account {}'.format(name, config.debug_account)
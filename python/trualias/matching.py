@@ -26,14 +26,144 @@ There are special matchers for "anything" and codes. Code matchers are built on
 the fly from the calc functions specified in an ACCOUNT declaration.
 """
 
-MATCH_ALPHA = set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz')
-MATCH_NUMBER = set('1234567890')
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import accumulate
+
+# What trualias.alias gets with "from .matching import *". The character sets are
+# only built here.
+__all__ = [ 'MATCH_ALPHA', 'MATCH_NUMBER', 'MATCH_ALNUM', 'MATCH_FQDN', 'MATCH_IDENT',
+            'NUMBER_MASK', 'NUMBER_RE',
+            'char_mask', 'char_table', 'char_class', 'char_codes', 'all_numbers',
+            'AddressIndex', 'Matcher', 'MatchFQDN', 'MatchAny', 'MatchCode'
+          ]
+
+MATCH_ALPHA = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz')
+MATCH_NUMBER = frozenset('1234567890')
 MATCH_ALNUM = MATCH_ALPHA | MATCH_NUMBER
-MATCH_FQDN = MATCH_ALNUM | set('.-')
-MATCH_IDENT = MATCH_ALNUM | set('_')
+MATCH_FQDN = MATCH_ALNUM | frozenset('.-')
+MATCH_IDENT = MATCH_ALNUM | frozenset('_')
+
+def char_mask(chars):
+    """Returns an integer bitmask with the bit for each character in chars set.
+    
+    Membership is tested with (mask >> ord(c)) & 1. A mask of -1 matches
+    any character.
+    """
+    mask = 0
+    for c in chars:
+        mask |= 1 << ord(c)
+    return mask
+
+NUMBER_MASK = char_mask(MATCH_NUMBER)
+
+@lru_cache(maxsize=64)
+def char_table(mask):
+    """Returns a bytes.translate() table mapping the codes in mask to 1, others to 0.
+    
+    The same membership test as the mask, but a whole (ASCII) address can be
+    tested in one call.
+    """
+    return bytes( (mask >> c) & 1 for c in range(256) )
+
+def char_class(chars):
+    """Returns a regular expression character class matching chars."""
+    return '[' + ''.join( re.escape(c) for c in sorted(chars) ) + ']'
+
+NUMBER_RE = re.compile(char_class(MATCH_NUMBER))
+
+def all_numbers(s):
+    """Returns True if every character in s (there may be none) is in MATCH_NUMBER.
+    
+    The same as set(s) <= MATCH_NUMBER without building the set. isdigit() alone
+    accepts digits in other scripts.
+    """
+    return not s or s.isascii() and s.isdigit()
+
+def char_codes(address):
+    """Returns the character codes of address as a sequence of ints.
+    
+    Addresses are almost always ASCII, in which case this is the encoded bytes
+    (indexing bytes returns an int directly); otherwise it's a list of ord()s.
+    """
+    if address.isascii():
+        return address.encode('ascii')
+    return [ ord(c) for c in address ]
+
+class AddressIndex(object):
+    """Things about an address which are worth computing once per address.
+    
+    An address may be matched against a sketch many times over (once for each
+    account / alias combination) and the same questions get asked every time.
+    
+        address     The address.
+        codes       The character codes of the address (see char_codes()).
+    """
+    def __init__(self, address):
+        self.address = address
+        self.codes = char_codes(address)
+        self.positions = {}
+        self.class_matches = {}
+        self.class_counts = {}
+        return
+    
+    def matches(self, mask):
+        """Returns which characters in the address match mask.
+        
+        matches[k] is 1 if address[k] matches and 0 otherwise, so the next match at
+        or after k is matches.find(1, k).
+        """
+        matches = self.class_matches.get(mask)
+        if matches is None:
+            codes = self.codes
+            if isinstance(codes, bytes):
+                matches = codes.translate(char_table(mask))
+            else:
+                matches = bytes( (mask >> c) & 1 for c in codes )
+            self.class_matches[mask] = matches
+        return matches
+    
+    def counts(self, mask):
+        """Returns the running counts of characters in the address matching mask.
+        
+        counts[k] is the number of characters in address[0:k] which match, so the
+        number in address[i:j] is counts[j] - counts[i].
+        """
+        counts = self.class_counts.get(mask)
+        if counts is None:
+            counts = self.class_counts[mask] = list(accumulate(self.matches(mask), initial=0))
+        return counts
+    
+    def offsets(self, s):
+        """Returns the (sorted) offsets at which the string s occurs.
+        
+        Occurrences may overlap.
+        """
+        offsets = self.positions.get(s)
+        if offsets is None:
+            offsets = self.positions[s] = []
+            k = self.address.find(s)
+            while k >= 0:
+                offsets.append(k)
+                k = self.address.find(s, k+1)
+        return offsets
+    
+    def find(self, s, start_pos):
+        """The equivalent of address.find(s, start_pos)."""
+        offsets = self.offsets(s)
+        k = bisect_left(offsets, start_pos)
+        return offsets[k] if k < len(offsets) else -1
 
 class Matcher(object):
     """Matches stuff in the address."""
+    __slots__ = ( 'name', 'char_sets',
+                  'start_mask', 'middle_mask', 'end_mask',
+                  'exact_re', 'maximal_re', 'minimal_re', 'end_re'
+                )
+    # The fewest characters the Matcher can match.
+    min_length = 1
+
     def __init__(self,*char_sets):
         if len(char_sets) == 2 or len(char_sets) == 4:
             self.name = char_sets[0]
@@ -42,9 +172,35 @@ class Matcher(object):
             self.name = None
         if len(char_sets) == 1:
             char_sets = (char_sets[0],char_sets[0],char_sets[0])
-        self.char_sets = char_sets
+        self.char_sets = char_sets = tuple( frozenset(chars) for chars in char_sets )
+        ( self.start_mask, self.middle_mask, self.end_mask,
+          self.exact_re, self.maximal_re, self.minimal_re, self.end_re
+        ) = self.compile(char_sets)
         return
     
+    COMPILED = {}
+    
+    @classmethod
+    def compile(cls, char_sets):
+        """Returns the masks and regular expressions for the (start, middle, end) char_sets.
+        
+        These are shared by all Matchers with the same character sets.
+        """
+        compiled = cls.COMPILED.get(char_sets)
+        if compiled is None:
+            # The scan done by __call__(). Every character but the last has to be a
+            # middle, and the last has to be an end; the first also has to be a start.
+            start, middle, end = ( char_class(chars) for chars in char_sets )
+            compiled = cls.COMPILED[char_sets] = (
+                    char_mask(char_sets[0]), char_mask(char_sets[1]), char_mask(char_sets[2]),
+                    # A fixed string only needs interior characters to be middles.
+                    re.compile('(?={}){}|{}{}*{}'.format(start, end, start, middle, end)),
+                    re.compile('(?={}){}*{}'.format(start, middle, end)),
+                    re.compile('(?={}){}*?{}'.format(start, middle, end)),
+                    re.compile(end)
+                )
+        return compiled
+    
     def __repr__(self):
         name = getattr(self, 'name', None)
         if name is None:
@@ -64,35 +220,24 @@ class Matcher(object):
         """
         if start_pos >= len(address):
             return None
-        start_chars, middle_chars, end_chars = self.char_sets
        
         # Match a fixed string.
         if not (end_pos is None or minimal):
-            to_match = address[start_pos:end_pos+1]
-            if to_match and to_match[0] in start_chars and to_match[-1] in end_chars:
-                if len(to_match) > 2:
-                    if not set(to_match[1:-1]) <= middle_chars:
-                        return None
-                return (start_pos, end_pos)
-            return None
+            if self.exact_re.fullmatch(address, start_pos, end_pos+1) is None:
+                return None
+            return (start_pos, end_pos)
 
-        valid_end_pos = None
-        test_pos = start_pos
-        while test_pos < len(address):
-            test_char = address[test_pos]
-            if test_pos == start_pos:
-                if test_char not in start_chars:
-                    return None
-            if test_char in end_chars:
-                valid_end_pos = test_pos
-                if minimal and (end_pos is None or test_pos >= end_pos):
-                    break
-            if test_char not in middle_chars:
-                # Can't be any longer than this because the char isn't suitable for a middle.
-                break
-            test_pos += 1
-        if valid_end_pos is None:
+        if minimal and end_pos is None:
+            match = self.minimal_re.match(address, start_pos)
+        else:
+            match = self.maximal_re.match(address, start_pos)
+        if match is None:
             return None
+        valid_end_pos = match.end() - 1
+        
+        if minimal and end_pos is not None and valid_end_pos > end_pos:
+            # At least as long as end_pos: the first end at or after it.
+            valid_end_pos = self.end_re.search(address, max(start_pos, end_pos)).start()
         
         return (start_pos, valid_end_pos)
     
@@ -104,17 +249,29 @@ class Matcher(object):
         Special case of end_pos = start_pos - 1 is used to test the start of
         a match.
         """
-        if start_pos >= len(address):
-            return False
-        if (end_pos + 1) >= len(address):
+        if start_pos >= len(address) or (end_pos + 1) >= len(address):
             return False
-        if end_pos < start_pos and address[start_pos] not in self.char_sets[0]:
+        if end_pos < start_pos:
+            if not (self.start_mask >> ord(address[start_pos])) & 1:
+                return False
+        elif end_pos > start_pos and not (self.middle_mask >> ord(address[end_pos])) & 1:
             return False
-        if address[end_pos+1] not in self.char_sets[2]:
+        return (self.end_mask >> ord(address[end_pos+1])) & 1 == 1
+    
+    def check_range(self, index, start_pos, end_pos):
+        """Returns True if address[start_pos:end_pos+1] matches exactly.
+        
+        The same as self(address, start_pos, end_pos) but answered in constant
+        time from the AddressIndex. end_pos must be within the address.
+        """
+        codes = index.codes
+        if start_pos > end_pos:
             return False
-        if end_pos > start_pos and address[end_pos] not in self.char_sets[1]:
+        if not ((self.start_mask >> codes[start_pos]) & 1 and (self.end_mask >> codes[end_pos]) & 1):
             return False
-        
+        if (end_pos - start_pos) > 1:
+            counts = index.counts(self.middle_mask)
+            return counts[end_pos] - counts[start_pos+1] == end_pos - start_pos - 1
         return True
     
     def copy(self, name):
@@ -129,6 +286,7 @@ class MatchFQDN(Matcher):
     
     Enforces the rule that an FQDN must contain at least one internal ".".
     """
+    __slots__ = ()
     def __call__(self, address, start_pos=0, end_pos=None, minimal=False):
         start_end = Matcher.__call__(self, address, start_pos, end_pos, minimal)
         if start_end is None:
@@ -137,12 +295,23 @@ class MatchFQDN(Matcher):
             return None
         return start_end
     
+    DOT_MASK = char_mask('.')
+    
+    def check_range(self, index, start_pos, end_pos):
+        if not Matcher.check_range(self, index, start_pos, end_pos):
+            return False
+        counts = index.counts(self.DOT_MASK)
+        return counts[end_pos+1] > counts[start_pos]
+    
 class MatchAny(Matcher):
     """Matches anything and everything!
     
     Subclassed from Matcher for no good functional but every good
     nonfunctional reason.
     """
+    start_mask = middle_mask = end_mask = -1
+    min_length = 0
+    
     def __init__(self,*args):
         self.name = args and args[0] or ''
         return
@@ -168,18 +337,21 @@ class MatchAny(Matcher):
         if (end_pos + 1) >= len(address):
             return False
         return True
+    
+    def check_range(self, index, start_pos, end_pos):
+        return start_pos < len(index.codes)
 
 class MatchCode(MatchAny):
     """Special matcher for computed codes.
     
     Depending on what the calc is, there can be different matching requirements.
     """
-    MATCH_TYPES = { 'number', 'any' }
+    MATCH_TYPES = frozenset(( 'number', 'any' ))
     
     def __init__(self,name=None):
         self.name = name or ''
         self.char_sets = []     # Different contents than Matcher.
-        self.anchors = None
+        self.build_anchors()
         return
 
     def __repr__(self):
@@ -187,22 +359,26 @@ class MatchCode(MatchAny):
         return '{}{}'.format(name, self.char_sets)
 
     def build_anchors(self):
-        if self.anchors:
-            return
-        self.anchors = [0]
+        """(Re)builds the anchors and such from char_sets.
+        
+        This is done whenever char_sets changes, so that matching never has to.
+        """
+        anchors = [0]
         for match in self.char_sets:
             if match == 'any':
-                self.anchors[-1] += 1
+                anchors[-1] += 1
             else:
-                self.anchors.append(0)
+                anchors.append(0)
+        self.anchors = tuple(anchors)
         self.end_group_size = 0
         while (self.end_group_size + 1) < len(self.anchors) and not self.anchors[-1 - self.end_group_size]:
             self.end_group_size += 1
+        # The last characters of runs of numbers long enough to end the code.
+        self.end_group_re = re.compile('{}{{{}}}(?!{})'.format(NUMBER_RE.pattern, self.end_group_size, NUMBER_RE.pattern))
         self.min_chars = sum(self.anchors) + len(self.anchors) - 1
         return
 
     def __call__(self, address, start_pos=0, end_pos=None, minimal=False):
-        self.build_anchors()
         if start_pos >= len(address) or end_pos and end_pos >= len(address):
             return None
 
@@ -210,24 +386,21 @@ class MatchCode(MatchAny):
         n_at_end = self.anchors[-1] == 0
         
         # Case where the matcher starts with a number.
-        if n_at_start and address[start_pos] not in MATCH_NUMBER:
+        if n_at_start and not (NUMBER_MASK >> ord(address[start_pos])) & 1:
             return None
         # Case where the matcher ends with a number and end position is specified.
-        if n_at_end and end_pos and address[end_pos] not in MATCH_NUMBER:
+        if n_at_end and end_pos and not (NUMBER_MASK >> ord(address[end_pos])) & 1:
             return None
         
         # Start with a minimal match.
         minimal_end = start_pos
         for i in range(len(self.anchors)):
-            # On subsequent matches
+            # On subsequent matches skip to just past the next number.
             if i > 0:
-                while True:
-                    if minimal_end >= len(address):
-                        return None
-                    if address[minimal_end] in MATCH_NUMBER:
-                        break
-                    minimal_end += 1
-                minimal_end += 1
+                number = NUMBER_RE.search(address, minimal_end)
+                if number is None:
+                    return None
+                minimal_end = number.end()
             # Skip a minimal number of any characters.
             minimal_end += self.anchors[i]
             if minimal_end >= len(address) and not (i + 1) >= len(self.anchors):
@@ -253,29 +426,65 @@ class MatchCode(MatchAny):
         if n_at_end:
             # Any n's grouped together at the end must be dealt with together.
             if end_pos:
-                if not set(address[end_pos-self.end_group_size+1:end_pos+1]) <= MATCH_NUMBER:
+                if not all_numbers(address[end_pos-self.end_group_size+1:end_pos+1]):
                     return None
             else:
+                # The last group of numbers ending past the minimal match.
                 end_pos = minimal_end
-                curr_pos = minimal_end + 1
-                while True:
-                    if set(address[curr_pos-self.end_group_size+1:curr_pos+1]) <= MATCH_NUMBER:
-                        end_pos = curr_pos
-                    curr_pos += 1
-                    if curr_pos >= len(address):
-                        break
+                for group in self.end_group_re.finditer(address, max(0, minimal_end + 2 - self.end_group_size)):
+                    end_pos = group.end() - 1
 
         return start_pos, end_pos or len(address) - 1
     
     def match_one_more(self, address, start_pos, end_pos):
-        self.build_anchors()
         if start_pos >= len(address):
             return False
         if (end_pos + 1) >= len(address):
             return False
         if (end_pos - start_pos) + 1 < self.min_chars:
             return False
-        return set(address[end_pos-self.end_group_size+2:end_pos+2]) <= MATCH_NUMBER
+        return all_numbers(address[end_pos-self.end_group_size+2:end_pos+2])
+    
+    def check_range(self, index, start_pos, end_pos):
+        """The same as self(address, start_pos, end_pos) but using the AddressIndex.
+        
+        The characters are tested as codes, and the trailing group of numbers is
+        tested with running counts of digits.
+        """
+        codes = index.codes
+        if start_pos >= len(codes):
+            return False
+
+        n_at_end = self.anchors[-1] == 0
+        if self.anchors[0] == 0 and not (NUMBER_MASK >> codes[start_pos]) & 1:
+            return False
+        if n_at_end and end_pos and not (NUMBER_MASK >> codes[end_pos]) & 1:
+            return False
+        
+        # The minimal match.
+        numbers = index.matches(NUMBER_MASK)
+        minimal_end = start_pos
+        for i in range(len(self.anchors)):
+            if i > 0:
+                minimal_end = numbers.find(1, minimal_end)
+                if minimal_end < 0:
+                    return False
+                minimal_end += 1
+            minimal_end += self.anchors[i]
+            if minimal_end >= len(codes) and not (i + 1) >= len(self.anchors):
+                return False
+        minimal_end -= 1
+        
+        if end_pos <= minimal_end:
+            return end_pos == minimal_end
+        if n_at_end and end_pos:
+            group_start = end_pos - self.end_group_size + 1
+            if group_start < 0:
+                # Slices wrap around; let __call__ sort it out.
+                return self(index.address, start_pos, end_pos) is not None
+            counts = index.counts(NUMBER_MASK)
+            return counts[end_pos+1] - counts[group_start] == self.end_group_size
+        return True
     
     def append(self, match_type):
         """Appends things to char_sets.
@@ -286,6 +495,8 @@ class MatchCode(MatchAny):
         if match_type not in self.MATCH_TYPES:
             raise ValueError('Value must be in MATCH_TYPES.')
         self.char_sets.append(match_type)
-        self.anchors = None
+        self.build_anchors()
+        # Every calc consumes at least one character.
+        self.min_length = len(self.char_sets)
         return
 
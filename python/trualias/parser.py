@@ -21,9 +21,12 @@ by trualias.lookup.find(). The actual parsing / matching of an alias against
 the specifications is done by calling trualias.alias.Alias.match().
 """
 import logging
+from sys import intern
 from ipaddress import ip_address
 from io import StringIO
 import importlib
+from collections import deque
+from functools import lru_cache
 
 from .config_base import ConfigurationError, Loader, DEFAULT_CONFIG
 from .alias import Alias, Subscriptable
@@ -36,8 +39,12 @@ class ProcessorError(ConfigurationError):
     """An error was encountered loading the pre/post processing module."""
     pass
 
+# The conversions of setting values are pure, and memoized since the same
+# configuration tends to be loaded over and over.
+
 BOOLEAN_VALUE = { 'true':True, '1':True, 'false':False, '0':False }
 
+@lru_cache(maxsize=256)
 def to_boolean(value):
     """Map 0/1 and true/false as boolean values."""
     orig_value = value
@@ -46,9 +53,11 @@ def to_boolean(value):
         raise ValueError('Not a recognized boolean value: {}'.format(orig_value))
     return BOOLEAN_VALUE[value]
 
+@lru_cache(maxsize=256)
 def to_address(value):
     return ip_address(value)
 
+@lru_cache(maxsize=256)
 def to_port(value):
     orig_value = value
     value = int(value)
@@ -58,6 +67,7 @@ def to_port(value):
 
 LOGGING_LEVELS = dict(debug=logging.DEBUG, info=logging.INFO, warning=logging.WARNING, error=logging.ERROR, critical=logging.CRITICAL)
 
+@lru_cache(maxsize=256)
 def to_loglevel(value):
     orig_value = value
     value = value.lower()
@@ -65,14 +75,16 @@ def to_loglevel(value):
         raise ValueError('Not a valid logging level: {}'.format(orig_value))
     return LOGGING_LEVELS[value]
 
-BAD_ACCOUNT_LETTERS = set(' @')
+BAD_ACCOUNT_LETTERS = ' @'
 
+@lru_cache(maxsize=256)
 def to_account(value):
-    if not set(value).isdisjoint(BAD_ACCOUNT_LETTERS):
-        raise ValueError('Not a valid account: {}'.format(value))
+    for letter in BAD_ACCOUNT_LETTERS:
+        if letter in value:
+            raise ValueError('Not a valid account: {}'.format(value))
     return value
 
-NO_STATISTICS = {'none','no'}
+NO_STATISTICS = frozenset(('none','no'))
 
 def to_statistics(value):
     if value.lower() in NO_STATISTICS:
@@ -102,7 +114,7 @@ class StreamParsingLoader(Loader):
     to override read_line().
     """
 
-    CONFIG_FIRST_WORDS = set('HOST PORT LOGGING DEBUG STATISTICS PYTHON_IS_311 PROCESSOR'.split())
+    CONFIG_FIRST_WORDS = frozenset('HOST PORT LOGGING DEBUG STATISTICS PYTHON_IS_311 PROCESSOR'.split())
     CONFIG_SECOND_WORDS = dict(DEBUG=['ACCOUNT'])
     CONFIG_MAP = {
             'PYTHON_IS_311': ('python_is_311', to_boolean),
@@ -113,14 +125,16 @@ class StreamParsingLoader(Loader):
             'DEBUG ACCOUNT': ('debug_account', to_account),
             'STATISTICS': ('statistics', to_statistics)
         }
-    CALC_FUNC_NAMES = set('DIGITS ALPHAS LABELS CHARS VOWELS ANY NONE CHAR'.split())
+    CALC_FUNC_NAMES = frozenset('DIGITS ALPHAS LABELS CHARS VOWELS ANY NONE CHAR'.split())
     NONINTEGER_PARAM_VALUES = Subscriptable.NONINTEGER_PARAM_VALUES
     
     def __init__(self, fh):
         """Create a loader for the supplied filehandle."""
         self.fh = fh
+        self.lines = None
+        self.line = ''
         self.line_number = 0
-        self.buffer = ''
+        self.tokens = deque()
         self.token_ = None
         self.config = DEFAULT_CONFIG(minimal=True)
         return
@@ -131,16 +145,20 @@ class StreamParsingLoader(Loader):
         raise ParseError(reason, additional)
     
     def load(self):
-        """Load and parse the stream."""
+        """Load and parse the stream.
+        
+        All lines are read with read_line(), including the check for any which
+        remain once no more statements can be parsed.
+        """
         try:
             while self.statement():
                 pass
-            if self.token_ or self.buffer or self.fh.readline():
+            if self.token_ or self.tokens or self.read_line():
                 additional = {}
                 if self.token_:
                     additional['token'] = self.token_
-                if self.buffer:
-                    additional['buffer'] = self.buffer
+                if self.tokens:
+                    additional['buffer'] = ' '.join(self.tokens)
                 self.parse_error("Data remains in buffer.", **additional)
         except EOFError:
             pass
@@ -151,19 +169,24 @@ class StreamParsingLoader(Loader):
     def read_line(self):
         """Reads one line from the stream.
         
-        Read one line and return it.
+        Read one line and return it. The stream is read all at once, the first
+        time a line is wanted; self.lines holds the lines not yet returned.
         
-        The newline characters should be stripped and replaced with
-        (a single) white space.
+        Surrounding white space (including the newline) is stripped; token()
+        splits the line on white space anyway. Blank lines and comments are
+        skipped.
         """
+        if self.lines is None:
+            self.lines = iter(self.fh.readlines())
         while True:
             self.line_number += 1
-            line = self.fh.readline()
+            line = next(self.lines, '')
             if not line:
                 raise EOFError()
-            if line.lstrip().startswith('#'):
+            line = line.strip()
+            if not line or line.startswith('#'):
                 continue
-            return line.rstrip() + ' '
+            return line
 
     ## Parser components below here. ##
     
@@ -171,7 +194,12 @@ class StreamParsingLoader(Loader):
         """Any statement."""
         #print('statement...')
         self.partial = False
-        success = self.config_statement() or self.alias_spec()
+        # Alias specs are the bulk of any configuration, so dispatch on the
+        # leading keyword rather than trying a config statement first.
+        if self.token() == 'ACCOUNT':
+            success = self.alias_spec()
+        else:
+            success = self.config_statement()
         #print('...success: {}'.format(success))
         if success:
             self.partial = False
@@ -180,39 +208,45 @@ class StreamParsingLoader(Loader):
     @staticmethod
     def trailing(token,item):
         """Looks for a trailing instance of token in item."""
-        checked = item.split(token,maxsplit=1)
-        return checked[0], (len(checked) > 1) and checked[1] or ''
+        head, sep, tail = item.partition(token)
+        return head, tail
     
     def config_statement(self):
-        #print('config statement. in buffer: {}'.format(self.buffer))
-        item = self.token()
-        colon_seen = ':' in item
-        item, more = self.trailing(':',item)
+        #print('config statement. in buffer: {}'.format(self.tokens))
+        # One partition() both splits off and tells us about the colon.
+        item, colon, more = self.token().partition(':')
         if item not in self.CONFIG_FIRST_WORDS:
             return False
         self.token_matched()
         self.partial = True
-        if item in self.CONFIG_SECOND_WORDS:
+        second_words = self.CONFIG_SECOND_WORDS.get(item)
+        if second_words is not None:
             if more:
                 self.parse_error('Keyword error "{}".'.format(item))
-            keyword = self.token()
-            colon_seen = ':' in keyword
-            keyword, more = self.trailing(':',keyword)
-            if keyword not in self.CONFIG_SECOND_WORDS[item]:
+            keyword, colon, more = self.token().partition(':')
+            if keyword not in second_words:
                 self.parse_error('Unrecognized keyword "{}"'.format(keyword))
             self.token_matched()
             item += ' ' + keyword
-        if item not in self.CONFIG_MAP:
+        config_item = self.CONFIG_MAP.get(item)
+        if config_item is None:
             self.parse_error('Unrecognized item "{}"'.format(item))
-        config_item = self.CONFIG_MAP[item]
-        if not colon_seen:
+        if not colon:
             more = self.token()
             self.token_matched()
             if not more.startswith(':'):
                 self.parse_error('Invalid syntax for {}'.format(item))
-            discard, more = self.trailing(':', more)
-        self.config[config_item[0]] = config_item[1]((more + ' ' + self.buffer).strip())
-        self.buffer = ''
+            more = more[1:]
+        # The value is the rest of the line as written. What's left of it in
+        # self.tokens are its last tokens, so skip the ones before those.
+        tokens = self.tokens
+        rest = ''
+        if tokens:
+            line = self.line
+            rest = line.split(None, len(line.split()) - len(tokens))[-1]
+        setting, convert = config_item
+        self.config[setting] = convert((more + ' ' + rest).strip())
+        tokens.clear()
         return True
         
     def alias_spec(self):
@@ -231,8 +265,8 @@ class StreamParsingLoader(Loader):
         item = self.token()
         if item == 'USING':
             self.token_matched()
-            item == self.token()
-            spec.matchex.account_matcher = item
+            item = self.token()
+            spec.matchex.account_matcher = (item, self.line_number)
             self.token_matched()
         
             item = self.token()
@@ -272,14 +306,14 @@ class StreamParsingLoader(Loader):
         
     def accounts_or_aliases(self):
         """Runs of comma-separated idents."""
-        accounts = self.token()
+        parts = [ self.token() ]
         self.token_matched()
         item = self.token()
-        while accounts.endswith(',') or item.startswith(','):
+        while parts[-1].endswith(',') or item.startswith(','):
             self.token_matched()
-            accounts += item
+            parts.append(item)
             item = self.token()
-        return accounts.split(',')
+        return ''.join(parts).split(',')
     
     def parameters(self, func):
         params = ''
@@ -289,27 +323,33 @@ class StreamParsingLoader(Loader):
         params, more = self.trailing(')',params)
         self.token_ = more
         params = params.strip().split(',')
+        # Numeric parameters are converted to ints here, once.
         try:
             if func.upper() == 'CHAR':
                 if len(params) < 2:
                     self.parse_error('CHAR() requires a minimum of two arguments.')
                 if len(params) == 3:
-                    if params[0].lower() not in self.NONINTEGER_PARAM_VALUES:
-                        param = params[0]
-                        param and int(param)
+                    indices = [0]
+                    if params[0].lower() in self.NONINTEGER_PARAM_VALUES:
+                        indices = []
                 else:
-                    for param in params[:-1]:
-                        param and int(param)
+                    # Everything but the default character.
+                    indices = range(len(params)-1)
             else:
                 if len(params) > 1:
                     self.parse_error('{}() requires no more than one argument.'.format(func.upper()))
-                if len(params):
-                    param = params[0]
-                    if param.lower() not in self.NONINTEGER_PARAM_VALUES:
-                        param and int(param)
+                indices = [0]
+                if params[0].lower() in self.NONINTEGER_PARAM_VALUES:
+                    indices = []
+            for k in indices:
+                param = params[k]
+                if param:
+                    params[k] = int(param)
         except ValueError:
                 self.parse_error('Invalid calc parameter "{}" must be integer or "account" or "alias"'.format(param))
-        return (len(params) != 1 or params[0]) and params or []
+        if params == ['']:
+            return []
+        return params
 
     def calcs(self):
         calc_list = []
@@ -334,22 +374,21 @@ class StreamParsingLoader(Loader):
         return
     
     def token(self):
+        """Returns the current token.
+        
+        The current token remains current until token_matched() is called. Lines
+        are split into tokens as they're read; self.tokens holds what remains of
+        the current line, self.line. Tokens are interned, since keywords,
+        accounts and the like recur throughout a configuration.
+        """
         if self.token_:
             return self.token_
-        while True:
-            if not self.buffer:
-                self.buffer = self.read_line()
-            try:
-                tok, more = self.buffer.split(maxsplit=1)
-            except ValueError:
-                tok = self.buffer.strip()
-                more = ''
-            if not tok:
-                self.buffer = ''
-                continue
-            self.token_ = tok
-            self.buffer = more
-            return tok
+        tokens = self.tokens
+        while not tokens:
+            self.line = self.read_line()
+            tokens.extend(map(intern, self.line.split()))
+        self.token_ = tokens.popleft()
+        return self.token_
 
 class MultilineStringLoader(StreamParsingLoader):
     """A StreamParsingLoader which takes a multiline string.
@@ -358,9 +397,5 @@ class MultilineStringLoader(StreamParsingLoader):
     """
     def __init__(self, text):
         """Create a loader for the supplied multiline string."""
-        self.fh = StringIO(text)
-        self.line_number = 0
-        self.buffer = ''
-        self.token_ = None
-        self.config = DEFAULT_CONFIG(minimal=True)
+        StreamParsingLoader.__init__(self, StringIO(text))
         return
@@ -13,13 +13,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-class EndOfIterable(object):
-    """Something used by TestableIterator to determine the end of an iterable."""
-    pass
+# Used by TestableIterator to determine the end of an iterable.
+END_OF_ITERABLE = object()
     
 class TestableIterator(object):
     """An iterator which can be tested to see if it will return something."""
-    def __init__(self, iterable, empty_flag=EndOfIterable()):
+    def __init__(self, iterable, empty_flag=END_OF_ITERABLE):
         self.iterator = iter(iterable)
         self.length = len(iterable)
         self.empty_flag = empty_flag
@@ -31,7 +30,7 @@ class TestableIterator(object):
     
     def __call__(self):
         """Returns True if the next item is not equal to the empty_flag."""
-        return not isinstance(self.item, EndOfIterable)
+        return self.item is not self.empty_flag
     
     def next(self, lookahead=False):
         if lookahead:
@@ -45,6 +44,8 @@ class WrappedFunctionResult(object):
     
     The success property will provide true/false based on testing the result.
     """
+    __slots__ = ('result',)
+
     def __call__(self, result):
         self.result = result
         return self
@@ -56,9 +57,3 @@ class WrappedFunctionResult(object):
     def check_for_success(self):
         """Subclasses must implement this to test the result for success / failure."""
         pass
-    
-class BasicBooleanResult(WrappedFunctionResult):
-    """Something which implicitly returns true/false when tested as a boolean."""
-    
-    def check_for_success(self):
-        return self.result and True or False